@@ -10,6 +10,8 @@ from datetime import date
 from src.editor import Editor
 from src.tabBar import TabBar
 from src.extended import QAction, StatusBar, MenuBar
+from src.styles import THEMES
+from src.policy import FULL, MODES
 
 
 def open_file(*args):
@@ -34,6 +36,10 @@ def make_settings():
     if not os.path.isdir(home + '.idle-r/templates'):
         os.mkdir(home + '.idle-r/templates')
 
+    # Highlight cache folder for reopening unchanged files quickly
+    if not os.path.isdir(home + '.idle-r/highlight_cache'):
+        os.mkdir(home + '.idle-r/highlight_cache')
+
     # Recent files file
     if not os.path.isfile(home + '.idle-r/recent_files'):
         with open_file(home + '.idle-r/recent_files', 'w') as rfile: pass
@@ -83,6 +89,9 @@ class IDLE_R(QtWidgets.QMainWindow):
         # Set the number for file names
         self.file_index = 1
 
+        # The theme of the editors and the rest of the IDE
+        self.theme = 'IDLE'
+
         # Add menubar
         self.menu_bar = MenuBar()
         self.setMenuBar(self.menu_bar)
@@ -256,15 +265,35 @@ class IDLE_R(QtWidgets.QMainWindow):
         editMenu.addAction(action)
         action = self.newAction("Find Again", self.findAgain, "Ctrl+G")
         editMenu.addAction(action)
-        #action = self.newAction("Find Again Backwards", self.findAgainBW, "Shift+G")
-        #editMenu.addAction(action)
+        action = self.newAction("Find Again Backwards", self.findAgainBW, "Ctrl+Shift+G")
+        editMenu.addAction(action)
         action = self.newAction("Replace...", self.replace, "Ctrl+H")
         editMenu.addAction(action)
         action = self.newAction("Go to Line", self.goto_line, "Alt+G")
         editMenu.addAction(action)
+        action = self.newAction("Go to Symbol", self.goto_symbol, "Ctrl+Shift+O")
+        editMenu.addAction(action)
         action = self.newAction("Show Completions", self.showCompletions, "Ctrl+Space")
         editMenu.addAction(action)
 
+        editMenu.addSeparator()
+
+        # Theme menu
+        menu = editMenu.addMenu("Theme")
+        for theme in sorted(THEMES):
+            Theme = QAction(theme, self, self.setTheme)
+            Theme.setCheckable(True)
+            Theme.setChecked(theme == self.theme)
+            menu.addAction(Theme)
+
+        # Feature mode of the current tab, automatic by its size or set
+        self.featureMenu = editMenu.addMenu("Features")
+        self.featureMenu.aboutToShow.connect(self.checkFeatureMode)
+        for mode in ('Automatic',) + MODES:
+            Mode = QAction(mode.capitalize(), self, self.setFeatureMode)
+            Mode.setCheckable(True)
+            self.featureMenu.addAction(Mode)
+
         editMenu.addSeparator()
         #action = self.newAction("Use GVim", self.gvim, "Ctrl+Alt+G")
         #editMenu.addAction(action)
@@ -293,6 +322,14 @@ class IDLE_R(QtWidgets.QMainWindow):
         action = self.newAction("Strip trailing whitespace", self.strip_wspace)
         formatMenu.addAction(action)
 
+        formatMenu.addSeparator()
+
+        # Folding actions
+        action = self.newAction("Fold/Unfold Region", self.toggle_fold, 'Ctrl+-')
+        formatMenu.addAction(action)
+        action = self.newAction("Unfold All", self.unfold_all, 'Ctrl+=')
+        formatMenu.addAction(action)
+
         ## Add the "Debug" menu ##
         debugMenu = self.menu_bar.addMenu(pre + "Debug")
         action = self.newAction("Debugger", self.start_debugger)
@@ -331,6 +368,15 @@ class IDLE_R(QtWidgets.QMainWindow):
         except AttributeError:
             pass
 
+    def checkFeatureMode(self):
+        editor = self.tab_bar.currentWidget()
+        for Mode in self.featureMenu.actions():
+            mode = Mode.text().lower()
+            Mode.setEnabled(bool(editor))
+            Mode.setChecked(bool(editor) and (
+                editor.modeOverride == mode or
+                (editor.modeOverride is None and mode == 'automatic')))
+
     def closeEvent(self, event):
         edited = False
         for tab in range(self.tab_bar.count()):
@@ -423,7 +469,12 @@ class IDLE_R(QtWidgets.QMainWindow):
     def findAgain(self):
         editor = self.tab_bar.currentWidget()
         if editor:
-            editor.find(editor.find_text)
+            editor.find(editor.find_text, backward=False)
+
+    def findAgainBW(self):
+        editor = self.tab_bar.currentWidget()
+        if editor:
+            editor.find(editor.find_text, backward=True)
 
     def getTemplates(self):
         home = os.path.expanduser('~') + os.path.sep
@@ -450,6 +501,11 @@ class IDLE_R(QtWidgets.QMainWindow):
         if editor:
             editor.goto_line()
 
+    def goto_symbol(self):
+        editor = self.tab_bar.currentWidget()
+        if editor:
+            editor.goto_symbol()
+
     def indent_region(self):
         editor = self.tab_bar.currentWidget()
         if editor:
@@ -479,13 +535,17 @@ class IDLE_R(QtWidgets.QMainWindow):
 
         # Make editor and configure
         editor = Editor(self.statusBar)
-        editor.filename = filename
+        editor.setTheme(THEMES[self.theme][0])
+        editor.setFilename(filename)
         editor.isUntitled = True  # Makes untitled files distinguishable
 
         # Change tab text and window title to show file has been edited
         editor.textChanged.connect(self.unsaved)
         editor.textChanged.connect(self.changeWindowName)
 
+        # Show the feature mode on the tab when it changes
+        editor.modeChanged.connect(lambda mode: self.showMode(editor))
+
         # Add given text if any
         if text:
             if not template:
@@ -506,6 +566,7 @@ class IDLE_R(QtWidgets.QMainWindow):
             self.tab_bar.removeTab(index)
         tab = self.tab_bar.addTab(editor, os.path.basename(filename))
         self.tab_bar.setCurrentIndex(tab)
+        self.showMode(editor)
 
         # Set focus to the editor
         editor.setFocus(True if template else False)
@@ -562,13 +623,18 @@ class IDLE_R(QtWidgets.QMainWindow):
         home = os.path.expanduser('~') + os.path.sep
         with open_file(home + '.idle-r/workspaces/' + action) as workspace:
             data = workspace.read().split('\n')
-            files = data[:-2]
-            tab_index = int(data[-2])
-            for f in files:
+            files = data[:-1]
+            tab_index = int(data[-1])
+            for line in files:
+                # Each file may be followed by a tab and its folded lines
+                f, _, folds = line.partition('\t')
                 if os.path.isfile(f):
                     self.openFile(f)
                 else:
                     self.newFile(f)
+                if folds:
+                    editor = self.tab_bar.currentWidget()
+                    editor.setFoldedLines([int(n) for n in folds.split(',')])
             self.tab_bar.setCurrentIndex(tab_index)
 
     def paste(self):
@@ -709,7 +775,7 @@ class IDLE_R(QtWidgets.QMainWindow):
                     QtWidgets.QMessageBox.information(
                         self, 'Workspace Save Aborted!', message)
                     return
-            files.append(editor.filename)
+            files.append((editor.filename, editor.foldedLines()))
 
         # Get workspace name
         name, ok = QtWidgets.QInputDialog.getText(
@@ -743,6 +809,13 @@ class IDLE_R(QtWidgets.QMainWindow):
             self.alt = value
             self.addMenuActions()
 
+    def setFeatureMode(self, mode):
+        """Set the feature mode of the current tab, or let its size decide"""
+        editor = self.tab_bar.currentWidget()
+        if editor:
+            mode = mode.lower()
+            editor.setModeOverride(None if mode == 'automatic' else mode)
+
     def setMsgBoxPos(self, msgBox):
         rect = msgBox.geometry()
         w = self.width() / 2
@@ -752,6 +825,19 @@ class IDLE_R(QtWidgets.QMainWindow):
         msgBox.setGeometry(rect)
         return msgBox
 
+    def setTheme(self, theme):
+        """Switch every tab and the IDE's stylesheet to a theme"""
+        style, stylesheet = THEMES[theme]
+        cwd = os.path.dirname(os.path.realpath(__file__)) + '/'
+        with open_file(cwd + 'theme/' + stylesheet) as qss:
+            QtWidgets.QApplication.instance().setStyleSheet(qss.read())
+
+        # Restyle the open tabs (their text is not lexed again)
+        for index in range(self.tab_bar.count()):
+            self.tab_bar.widget(index).setTheme(style)
+        self.theme = theme
+        self.addMenuActions()
+
     def showCompletions(self):
         editor = self.tab_bar.currentWidget()
         if editor:
@@ -760,6 +846,16 @@ class IDLE_R(QtWidgets.QMainWindow):
             if not editor.textCursor().hasSelection():
                 editor.autocomplete()
 
+    def showMode(self, editor):
+        """Show a tab's feature mode after its name, unless it is full"""
+        index = self.tab_bar.indexOf(editor)
+        if index < 0:
+            return
+        name = re.sub(r' \[\w+\]$', '', self.tab_bar.tabText(index))
+        if editor.mode != FULL:
+            name += ' [%s]' % editor.mode
+        self.tab_bar.setTabText(index, name)
+
     def stack_viewer(self):
         pass
 
@@ -776,6 +872,11 @@ class IDLE_R(QtWidgets.QMainWindow):
         if editor:
             editor.tabify_region()
 
+    def toggle_fold(self):
+        editor = self.tab_bar.currentWidget()
+        if editor:
+            editor.toggle_fold()
+
     def uncomment_region(self):
         editor = self.tab_bar.currentWidget()
         if editor:
@@ -798,6 +899,11 @@ class IDLE_R(QtWidgets.QMainWindow):
             else:
                 self.tab_bar.setTabText(index, name.replace('* ', ''))
 
+    def unfold_all(self):
+        editor = self.tab_bar.currentWidget()
+        if editor:
+            editor.unfold_all()
+
     def untabify_region(self):
         editor = self.tab_bar.currentWidget()
         if editor:
@@ -829,7 +935,9 @@ class IDLE_R(QtWidgets.QMainWindow):
     def writeWorkspace(self, name, files):
         home = os.path.expanduser('~') + os.path.sep
         with open_file(home + '.idle-r/workspaces/' + name, 'w') as workspace:
-            for f in files:
+            for f, folds in files:
+                if folds:
+                    f += '\t' + ','.join(str(n) for n in folds)
                 workspace.write(f + '\n')
             workspace.write(str(self.tab_bar.currentIndex()))
 
@@ -0,0 +1,399 @@
+#
+#  brackets.py
+#
+import re
+from bisect import bisect_left, bisect_right
+from pygments.token import Comment, String
+
+# Kind and depth change of each bracket; brackets only match their own kind
+BRACKETS = {
+    '(': (0, 1), ')': (0, -1),
+    '[': (1, 1), ']': (1, -1),
+    '{': (2, 1), '}': (2, -1),
+}
+_bracket = re.compile(r'[()\[\]{}]')
+
+# Pseudo-kind that every bracket belongs to, for finding enclosing brackets
+ANY = 3
+
+# Block entries are (bracket chars, their columns); identical ones are shared
+_EMPTY = ('', ())
+_entries = {_EMPTY: _EMPTY}
+
+# Summaries are (total, lowest prefix, highest suffix) of the depth changes
+# of each kind in turn (ANY last), where the prefixes and suffixes include
+# empty ones
+_IDENTITY = (0, 0, 0) * 4
+
+
+def bracket_entry(text, runs=None):
+    """ Returns the entry of a block: the brackets in its text, leaving out
+    those in strings and comments when the (token, length) runs are known.
+    """
+    matches = [(m.start(), m.group()) for m in _bracket.finditer(text)]
+    if not matches:
+        return _EMPTY
+    if runs is not None:
+        kept = []
+        runs = iter(runs)
+        token, end = None, 0
+        for column, char in matches:
+            while column >= end:
+                token, length = next(runs, (None, len(text) - end))
+                end += length
+            if token is None or not (token in String or token in Comment):
+                kept.append((column, char))
+        matches = kept
+    entry = (''.join(char for _, char in matches),
+             tuple(column for column, _ in matches))
+    return _entries.setdefault(entry, entry)
+
+
+def _combine(left, right):
+    """ Returns the summary of two summarised sequences, one after the other.
+    """
+    t0, l0, h0, t1, l1, h1, t2, l2, h2, t3, l3, h3 = left
+    u0, m0, i0, u1, m1, i1, u2, m2, i2, u3, m3, i3 = right
+    return (t0 + u0, min(l0, t0 + m0), max(i0, h0 + u0),
+            t1 + u1, min(l1, t1 + m1), max(i1, h1 + u1),
+            t2 + u2, min(l2, t2 + m2), max(i2, h2 + u2),
+            t3 + u3, min(l3, t3 + m3), max(i3, h3 + u3))
+
+
+def _summarise(chars):
+    """ Returns the summary of the brackets of a block.
+    """
+    if not chars:
+        return _IDENTITY
+    summary = [0, 0, 0] * 4
+    for char in chars:
+        kind, change = BRACKETS[char]
+        for k in (kind * 3, ANY * 3):
+            summary[k] += change
+            summary[k + 1] = min(summary[k + 1], summary[k])
+            summary[k + 2] = max(summary[k + 2] + change, 0)
+    return tuple(summary)
+
+
+class BracketIndex(object):
+    """ Incremental index of the brackets of a document, for matching them.
+
+        Each block has an entry with its brackets outside strings and
+        comments (from the highlighter's runs). The entries are kept in
+        chunks of consecutive blocks, and a segment tree over the chunks
+        holds the total, lowest prefix and highest suffix of the depth of
+        each kind of bracket. Finding a match descends the tree, so it costs
+        O(log n) plus a scan of one chunk, however far away the match is;
+        so does finding the bracket that encloses a position.
+
+        The index follows block insertions and removals through the
+        document's contentsChange signal, which must be connected before the
+        highlighter's (see PygmentsHighlighter). Entries that are not known
+        yet (None) are read from the block's text when they are needed.
+    """
+
+    chunk_size = 64
+
+    # Blocks longer than this are left out when reading unknown entries
+    # (see PygmentsHighlighter.set_long_line)
+    long_line = None
+
+    def __init__(self, document):
+        self._document = document
+        self._count = document.blockCount()
+        self._rechunk([None] * self._count)
+        document.contentsChange.connect(self._contents_change)
+
+    def __len__(self):
+        return self._count
+
+    def enclosing(self, position):
+        """ Returns the position of the innermost indexed bracket left open
+        before a document position, or None.
+        """
+        block = self._document.findBlock(position)
+        if not block.isValid():
+            return None
+        number = block.blockNumber()
+        chunk = bisect_right(self._starts, number) - 1
+        chars, columns = self._entry(chunk, number - self._starts[chunk])
+        index = bisect_left(columns, position - block.position())
+        return self._search(number, chars, columns, index - 1, ANY, False)
+
+    def is_bracket(self, position):
+        """ Whether there is an indexed bracket (i.e. not in a string or
+        comment) at a document position.
+        """
+        return self._find(position) is not None
+
+    def match(self, position):
+        """ Returns the position of the bracket matching the one at a
+        document position, or None if it has no match or is not indexed.
+        """
+        found = self._find(position)
+        if found is None:
+            return None
+        number, chars, columns, index = found
+        kind, change = BRACKETS[chars[index]]
+        forward = change > 0
+        return self._search(number, chars, columns,
+                            index + 1 if forward else index - 1, kind, forward)
+
+    def update(self, number, entry):
+        """ Sets the entry of a block; None when it is not known.
+        """
+        chunk = bisect_right(self._starts, number) - 1
+        offset = number - self._starts[chunk]
+        if offset < len(self._chunks[chunk]) and \
+                self._chunks[chunk][offset] is not entry:
+            self._chunks[chunk][offset] = entry
+            self._sums[chunk] = None
+            self._dirty.add(chunk)
+
+    #---------------------------------------------------------------------------
+    # Protected interface
+    #---------------------------------------------------------------------------
+
+    def _contents_change(self, position, removed, added):
+        """ Inserts or removes the entries of the blocks that were inserted
+        or removed, and forgets those of the changed blocks.
+        """
+        document = self._document
+        first = document.findBlock(position).blockNumber()
+        last = document.findBlock(position + added).blockNumber()
+        if first < 0:
+            first = document.blockCount() - 1
+        if last < 0:
+            last = document.blockCount() - 1
+        delta = document.blockCount() - self._count
+        if delta:
+            self._count += delta
+            chunk = bisect_right(self._starts, first) - 1
+            offset = first - self._starts[chunk] + 1
+            entries = self._chunks[chunk]
+            if delta > 0 and len(entries) + delta <= 2 * self.chunk_size:
+                entries[offset:offset] = [None] * delta
+                if len(entries) > self.chunk_size * 3 // 2:
+                    self._split(chunk)
+            elif delta < 0 and offset - delta <= len(entries) and \
+                    len(entries) + delta > 0:
+                del entries[offset:offset - delta]
+            else:
+                # Spans chunks, or leaves one too big or empty: start over
+                entries = [entry for chunk in self._chunks for entry in chunk]
+                if delta > 0:
+                    entries[first + 1:first + 1] = [None] * delta
+                else:
+                    del entries[first + 1:first + 1 - delta]
+                self._rechunk(entries)
+                chunk = None
+            if chunk is not None:
+                self._starts = [0]
+                for entries in self._chunks[:-1]:
+                    self._starts.append(self._starts[-1] + len(entries))
+                self._sums[chunk] = None
+                self._dirty.add(chunk)
+
+        # Forget the entries of the changed blocks, a chunk at a time
+        number, last = first, max(first, last)
+        while number <= last:
+            chunk = bisect_right(self._starts, number) - 1
+            entries = self._chunks[chunk]
+            offset = number - self._starts[chunk]
+            stop = min(len(entries), last - self._starts[chunk] + 1)
+            if offset >= stop:
+                break
+            entries[offset:stop] = [None] * (stop - offset)
+            self._sums[chunk] = None
+            self._dirty.add(chunk)
+            number = self._starts[chunk] + stop
+
+    def _entry(self, chunk, offset):
+        """ Returns the entry at an offset of a chunk, reading unknown ones
+        from the block's text.
+        """
+        entry = self._chunks[chunk][offset]
+        if entry is None:
+            number = self._starts[chunk] + offset
+            block = self._document.findBlockByNumber(number)
+            if self.long_line is not None and \
+                    block.length() - 1 > self.long_line:
+                entry = self._chunks[chunk][offset] = _EMPTY
+            else:
+                entry = self._chunks[chunk][offset] = \
+                    bracket_entry(block.text())
+        return entry
+
+    def _find(self, position):
+        """ Returns (block number, chars, columns, index) of the indexed
+        bracket at a document position, or None.
+        """
+        block = self._document.findBlock(position)
+        if not block.isValid():
+            return None
+        number = block.blockNumber()
+        chunk = bisect_right(self._starts, number) - 1
+        chars, columns = self._entry(chunk, number - self._starts[chunk])
+        column = position - block.position()
+        for index, other in enumerate(columns):
+            if other == column:
+                return number, chars, columns, index
+        return None
+
+    def _position(self, number, column):
+        return self._document.findBlockByNumber(number).position() + column
+
+    def _rechunk(self, entries):
+        """ Splits the entries into chunks again and drops the tree.
+        """
+        size = self.chunk_size
+        self._chunks = [entries[i:i + size]
+                        for i in range(0, len(entries), size)] or [[]]
+        self._starts = list(range(0, len(entries), size)) or [0]
+        self._sums = [None] * len(self._chunks)
+        self._dirty = set()
+        self._tree = None
+
+    def _scan(self, chunk, offset, depth, kind, forward):
+        """ Scans a chunk's blocks from an offset, forward or backward, for
+        the bracket of a kind at which the depth goes below zero.
+
+            Returns (its position, depth) or (None, depth at the chunk end).
+        """
+        entries = self._chunks[chunk]
+        for offset in range(offset, len(entries)) if forward else \
+                range(offset, -1, -1):
+            chars, columns = self._entry(chunk, offset)
+            for i in range(len(chars)) if forward else \
+                    range(len(chars) - 1, -1, -1):
+                other, change = BRACKETS[chars[i]]
+                if kind == ANY or other == kind:
+                    depth += change if forward else -change
+                    if depth < 0:
+                        number = self._starts[chunk] + offset
+                        return self._position(number, columns[i]), depth
+        return None, depth
+
+    def _search(self, number, chars, columns, index, kind, forward):
+        """ Finds the bracket of a kind at which the depth goes below zero,
+        starting at an index of a block's brackets.
+        """
+        # Look through the rest of the block and its chunk, then find the
+        # chunk the bracket is in with the tree and scan that
+        depth = 0
+        for i in range(index, len(chars)) if forward else \
+                range(index, -1, -1):
+            other, change = BRACKETS[chars[i]]
+            if kind == ANY or other == kind:
+                depth += change if forward else -change
+                if depth < 0:
+                    return self._position(number, columns[i])
+        chunk = bisect_right(self._starts, number) - 1
+        offset = number - self._starts[chunk]
+        found, depth = self._scan(chunk, offset + 1 if forward else offset - 1,
+                                  depth, kind, forward)
+        if found is None:
+            found = self._search_tree(chunk, depth, kind, forward)
+            if found is None:
+                return None
+            chunk, depth = found
+            found, depth = self._scan(
+                chunk, 0 if forward else len(self._chunks[chunk]) - 1,
+                depth, kind, forward)
+        return found
+
+    def _search_tree(self, chunk, depth, kind, forward):
+        """ Finds the nearest chunk after (or before) a chunk in which the
+        depth leaves its range, and the depth on entering that chunk.
+        """
+        tree, size = self._update_tree()
+
+        # Collect the nodes covering the chunks after (or before) the chunk,
+        # nearest first
+        low, high = (chunk + 1, len(self._chunks)) if forward else \
+            (0, chunk)
+        left, right = low + size, high + size
+        left_nodes, right_nodes = [], []
+        while left < right:
+            if left & 1:
+                left_nodes.append(left)
+                left += 1
+            if right & 1:
+                right -= 1
+                right_nodes.append(right)
+            left >>= 1
+            right >>= 1
+        nodes = left_nodes + right_nodes[::-1]
+        if not forward:
+            nodes.reverse()
+
+        # Find the first node the depth goes below zero in, and descend it;
+        # going backward, the depth counts closing brackets up
+        k = kind * 3
+        sign = 1 if forward else -1
+        for node in nodes:
+            summary = tree[node]
+            if depth + (summary[k + 1] if forward else -summary[k + 2]) < 0:
+                while node < size:
+                    first, second = (2 * node, 2 * node + 1) if forward else \
+                        (2 * node + 1, 2 * node)
+                    summary = tree[first]
+                    if depth + (summary[k + 1] if forward else
+                                -summary[k + 2]) < 0:
+                        node = first
+                    else:
+                        depth += sign * summary[k]
+                        node = second
+                return node - size, depth
+            depth += sign * summary[k]
+        return None
+
+    def _split(self, chunk):
+        """ Splits a chunk that grew too big in two.
+        """
+        entries = self._chunks[chunk]
+        half = len(entries) // 2
+        self._chunks[chunk:chunk + 1] = [entries[:half], entries[half:]]
+        self._sums[chunk:chunk + 1] = [None, None]
+        self._dirty = set(other + (other > chunk) for other in self._dirty)
+        self._dirty.update((chunk, chunk + 1))
+        self._tree = None
+
+    def _summary(self, chunk):
+        """ Returns the summary of a chunk, working it out if needed.
+        """
+        summary = self._sums[chunk]
+        if summary is None:
+            summary = self._sums[chunk] = _summarise(''.join(
+                self._entry(chunk, offset)[0]
+                for offset in range(len(self._chunks[chunk]))))
+        return summary
+
+    def _update_tree(self):
+        """ Returns the segment tree and its size, rebuilding the nodes of
+        the chunks that changed.
+        """
+        count = len(self._chunks)
+        if self._tree is None:
+            size = 1
+            while size < count:
+                size *= 2
+            tree = [_IDENTITY] * (2 * size)
+            for chunk in range(count):
+                tree[size + chunk] = self._summary(chunk)
+            for node in range(size - 1, 0, -1):
+                tree[node] = _combine(tree[2 * node], tree[2 * node + 1])
+            self._tree = tree, size
+            self._dirty.clear()
+            return tree, size
+
+        tree, size = self._tree
+        for chunk in self._dirty:
+            node = size + chunk
+            tree[node] = self._summary(chunk)
+            node //= 2
+            while node:
+                tree[node] = _combine(tree[2 * node], tree[2 * node + 1])
+                node //= 2
+        self._dirty.clear()
+        return tree, size
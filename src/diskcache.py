@@ -0,0 +1,141 @@
+#
+#  diskcache.py
+#
+import hashlib
+import os
+import struct
+import sys
+from array import array
+import pygments
+
+# Bump when the lexers or the file layout change, to drop old entries
+FORMAT_VERSION = 1
+
+# Magic, format version and the byte sizes of the strings, states, run counts
+# and runs that follow; the arrays are unsigned ints in native byte order
+_header = struct.Struct('<4sHIIII')
+_magic = b'IDRH'
+
+
+class HighlightCache(object):
+    """ Size-bounded on-disk cache of the runs and syntax stacks of lexed
+    files, keyed by a hash of their text and the lexer and style versions.
+
+        Entries hold the same (token names, [(runs, exit stack), ...]) as a
+        lex_lines batch. The least recently used entries are removed once
+        the folder grows past max_bytes.
+    """
+
+    max_bytes = 64 * 1024 * 1024
+
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = os.path.join(
+                os.path.expanduser('~'), '.idle-r', 'highlight_cache')
+        self.directory = directory
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+    def key(self, text, version):
+        """ Returns the key of text lexed and styled at the given version.
+        """
+        digest = hashlib.sha1()
+        digest.update(('%s %s %s %s\0' % (
+            FORMAT_VERSION, pygments.__version__, sys.byteorder, version)
+        ).encode('utf-8'))
+        digest.update(text.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def load(self, key):
+        """ Returns the (token names, [(runs, exit stack), ...]) of an entry,
+        or None if there is no valid entry for key.
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        try:
+            magic, version, *sizes = _header.unpack_from(data)
+            if magic != _magic or version != FORMAT_VERSION or \
+                    _header.size + sum(sizes) != len(data):
+                return None
+            chunks = []
+            offset = _header.size
+            for size in sizes:
+                chunks.append(data[offset:offset + size])
+                offset += size
+            strings = chunks[0].decode('utf-8').split('\n')
+            states, counts, runs = array('I'), array('I'), array('I')
+            states.frombytes(chunks[1])
+            counts.frombytes(chunks[2])
+            runs.frombytes(chunks[3])
+
+            # The strings are the number of token names, the names and then
+            # the stacks, each as its state names separated by tabs
+            count = int(strings[0])
+            names = strings[1:count + 1]
+            stacks = [tuple(stack.split('\t'))
+                      for stack in strings[count + 1:]]
+            lines = []
+            index = 0
+            for state, pairs in zip(states, counts):
+                lines.append((tuple(runs[index:index + 2 * pairs]),
+                              stacks[state]))
+                index += 2 * pairs
+        except (struct.error, ValueError, IndexError, UnicodeDecodeError):
+            return None
+        return names, lines
+
+    def store(self, key, names, lines):
+        """ Writes an entry, then evicts old entries if needed. Failures are
+        ignored, as the cache is only an optimisation.
+        """
+        stacks = {}
+        states, counts, runs = array('I'), array('I'), array('I')
+        for line_runs, stack in lines:
+            index = stacks.get(stack)
+            if index is None:
+                index = stacks[stack] = len(stacks)
+            states.append(index)
+            counts.append(len(line_runs) // 2)
+            runs.extend(line_runs)
+        strings = '\n'.join([str(len(names))] + list(names) +
+                            ['\t'.join(stack) for stack in stacks])
+        parts = (strings.encode('utf-8'), states.tobytes(), counts.tobytes(),
+                 runs.tobytes())
+
+        path = os.path.join(self.directory, key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(_header.pack(_magic, FORMAT_VERSION,
+                                     *(len(part) for part in parts)))
+                for part in parts:
+                    f.write(part)
+            os.replace(path + '.tmp', path)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self):
+        """ Removes the least recently used entries past max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
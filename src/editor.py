@@ -2,9 +2,22 @@
 #  editor.py
 #
 from PySide2 import QtCore, QtGui, QtWidgets
+from pygments.token import Token
 from src.highlighter import PygmentsHighlighter
-from src.extended import FindDialog, ReplaceDialog, codeToolTip
+from src.indent import IndentEngine, IndentLevels
+from src.folding import FoldEngine
+from src.policy import FEATURES, FULL, FeaturePolicy, measure
+from src import region
+from src.lexer import lexer_for_filename
+from src.search import OccurrenceCounter, RegexJob, SearchIndex, \
+    find_pattern, utf16_spans
+from src.semantic import SemanticOverlay
+from src.symbols import SymbolIndex
+from src.styles import PythonStyle
+from src.extended import FindDialog, ReplaceDialog, SymbolDialog, \
+    codeToolTip
 from src.completer import CodeAnalyser, Completer, Autocompleter
+from contextlib import contextmanager
 import random
 import re
 import os
@@ -16,21 +29,44 @@ class LineArea(QtWidgets.QWidget):
     def __init__(self, editor):
         QtWidgets.QWidget.__init__(self, editor)
         self.editor = editor
+        self.digitWidth = editor.fontMetrics().width('9')
+        # Line numbers already rendered, by number
+        self.pixmaps = {}
+
+    def pixmap(self, number):
+        # Render each line number once, then reuse it when painting
+        pixmap = self.pixmaps.get(number)
+        if pixmap is None:
+            if len(self.pixmaps) >= 4096:
+                self.pixmaps.clear()
+            text = str(number)
+            fm = self.editor.fontMetrics()
+            ratio = self.devicePixelRatioF()
+            pixmap = QtGui.QPixmap(int(len(text) * self.digitWidth * ratio),
+                                   int(fm.height() * ratio))
+            pixmap.setDevicePixelRatio(ratio)
+            pixmap.fill(QtCore.Qt.transparent)
+            painter = QtGui.QPainter(pixmap)
+            painter.setFont(self.editor.font())
+            painter.setPen(self.editor.textColor)
+            painter.drawText(0, fm.ascent(), text)
+            painter.end()
+            self.pixmaps[number] = pixmap
+        return pixmap
 
     def sizeHint(self, *args, **kwargs):
         return QtCore.QSize(self.editor.lineAreaWidth(), 0)
 
-    def paintEvent(self, event):
-        self.editor.lineAreaPaintEvent(event)
-
-
-class ColumnLine(LineArea):
+    def mousePressEvent(self, event):
+        self.editor.lineAreaMousePressEvent(event)
 
     def paintEvent(self, event):
-        self.editor.columnLinePaintEvent(event)
+        self.editor.lineAreaPaintEvent(event)
 
 
 class Editor(QtWidgets.QPlainTextEdit):
+    # Emitted with the new feature mode when it changes (see setMode)
+    modeChanged = QtCore.Signal(str)
     isUntitled = False
     filename = ''
     indentation = 0
@@ -41,17 +77,25 @@ class Editor(QtWidgets.QPlainTextEdit):
     find_fromStart = 0
     find_wholeWord = 0
     find_backward = 0
+    find_regex = 0
+    pendingFind = None
     # Vars for replacing text
     replace_text = ''
     replace_with = ''
     replace_caseSensitive = 0
     replace_wholeWord = 0
     replace_backward = 0
+    replace_regex = 0
     hadSelection = False
     inTemplate = False
     templateStart = 0
     # When last action was inserting a completion
     completed = False
+    # Texts with at least this many lines are lexed in a worker process
+    backgroundLexLines = 5000
+    # Lines longer than this are only highlighted and searched for words and
+    # braces in a window of this many characters around the cursor
+    longLine = 20000
 
     def __init__(self, statusBar):
         super(Editor, self).__init__()
@@ -81,8 +125,44 @@ class Editor(QtWidgets.QPlainTextEdit):
         # Status bar
         self.statusBar = statusBar
 
-        # Syntax highlighting
+        # Features are switched to cheaper modes for big documents (see
+        # setMetrics), unless a mode is set for this editor
+        self.policy = FeaturePolicy()
+        self.modeOverride = None
+        self.mode = FULL
+        self.features = FEATURES[FULL]
+        self.metrics = measure('')
+
+        # Syntax highlighting (visible blocks first, the rest when idle)
         self.highlighter = PygmentsHighlighter(self)
+        self.highlighter.set_lazy(True)
+        self.highlighter.set_long_line(self.longLine)
+        self.verticalScrollBar().valueChanged.connect(
+            self.highlighter.update_viewport)
+
+        # Semantic highlighting, worked out in the background when idle
+        self.semantic = SemanticOverlay(self)
+        self.highlighter.set_overlay(self.semantic)
+
+        # Indentation of new lines, from the highlighter's state
+        self.indenter = IndentEngine(self.highlighter)
+
+        # Matches of the last search, highlighted in the viewport
+        self.search = SearchIndex(self.document(), self)
+        self.search.changed.connect(self.updateExtraSelections)
+        self.search.finished.connect(self.findPending)
+        self.search.failed.connect(self.searchFailed)
+        self.verticalScrollBar().valueChanged.connect(
+            self.updateExtraSelections)
+
+        # Lines of the def and class statements, for Go to Symbol
+        self.symbols = SymbolIndex(self.document(), self)
+
+        # Occurrences of the selection, counted and highlighted after a pause
+        self.occurrences = OccurrenceCounter(self.document(), self)
+        self.occurrences.settled.connect(self.showOccurrences)
+        self.occurrences.counted.connect(self.showOccurrenceCount)
+        self.occurrenceWord = None
 
         # Add line number label to status bar and update it
         self.lineNumber = QtWidgets.QLabel()
@@ -96,21 +176,41 @@ class Editor(QtWidgets.QPlainTextEdit):
         self.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
         self.setFrameStyle(QtWidgets.QFrame.NoFrame)
 
-        # Draw the column line
-        self.enableColumnLine = False
-        if self.enableColumnLine:
-            self.columnLine = ColumnLine(self)
-            fm = self.fontMetrics()
-            self.columnLine.setGeometry((0.5 + fm.width('0')) * 80, 0, 1, 1000)
+        # Lines are only wrapped while one is very long, and the feature
+        # mode follows the document's size (see setMetrics)
+        self.measureTimer = QtCore.QTimer(self)
+        self.measureTimer.setSingleShot(True)
+        self.measureTimer.setInterval(500)
+        self.measureTimer.timeout.connect(
+            lambda: self.setMetrics(measure(self.toPlainText())))
+        self.document().contentsChange.connect(self.updateMetrics)
+
+        # Draw the column line and indentation guides over the text
+        self.enableColumnLine = True
+        self.enableIndentGuides = True
+        self.indentLevels = IndentLevels(self.document(), max(1, round(
+            self.tabStopWidth() / self.fontMetrics().width(' '))))
+        self.document().contentsChange.connect(self.updateIndentGuides)
+
+        # Folding of indented regions, unfolded when the cursor goes in
+        self.folds = FoldEngine(self.document(), self.indentLevels,
+                                self.highlighter.brackets)
+        self.cursorPositionChanged.connect(self.unfoldCursor)
 
         # Create line number widget
-        self.enableLineNumbers = False
+        self.enableLineNumbers = True
         if self.enableLineNumbers:
             self.lineArea = LineArea(self)
+            self.lineDigits = 0
+
+            # With a lazy gutter, repaint it once scrolling pauses
+            self.lineAreaTimer = QtCore.QTimer(self)
+            self.lineAreaTimer.setSingleShot(True)
+            self.lineAreaTimer.setInterval(150)
+            self.lineAreaTimer.timeout.connect(self.lineArea.update)
 
             # Connect relevant signals to line number widget
-            self.connect(self, QtCore.SIGNAL('cursorPositionChanged()'), \
-                        self.updateLineAreaWidth)
+            self.blockCountChanged.connect(self.updateLineAreaWidth)
             self.connect(self, QtCore.SIGNAL('updateRequest(QRect, int)'), \
                         self.updateLineArea)
 
@@ -121,10 +221,8 @@ class Editor(QtWidgets.QPlainTextEdit):
         self.connect(self, QtCore.SIGNAL('copyAvailable(bool)'), \
                     self.show_parens)
 
-        # Set cursor format
-        format = QtGui.QTextCharFormat()
-        format.setForeground(QtGui.QColor('#000000'))
-        self.setCurrentCharFormat(format)
+        # Colours of the text, gutter and overlay (see setTheme)
+        self.setTheme(PythonStyle)
 
     def focusInEvent(self, *args):
         self.statusBar.addPermanentWidget(self.lineNumber)
@@ -180,16 +278,30 @@ class Editor(QtWidgets.QPlainTextEdit):
         if self.completer.completionCount():
             self.completer.showCompleter()
 
-    def columnLinePaintEvent(self, event):
-        if self.enableColumnLine:
-            # Repaint on top first
-            self.update()
-
-            # Draw column line area
-            painter = QtWidgets.QPainter(self.columnLine)
-            color = QtGui.QColor("#000000")
-            color.setAlpha(80)
-            painter.fillRect(event.rect(), color)
+    @contextmanager
+    def bulkEdit(self):
+        # Suspend highlighting and the editor's signals (status bar, unsaved
+        # marker...) during a big edit, then highlight the changed blocks and
+        # emit the signals once
+        self.highlighter.suspend()
+        blocked = self.blockSignals(True)
+        try:
+            yield
+        finally:
+            changed = self.highlighter.resume()
+            self.blockSignals(blocked)
+            if not blocked:
+                if changed:
+                    self.textChanged.emit()
+                self.cursorPositionChanged.emit()
+            # blockCountChanged and updateRequest were blocked too, so size
+            # and repaint the gutter for the new line count here
+            if self.enableLineNumbers:
+                self.updateLineAreaWidth()
+                self.lineArea.update()
+
+    def comment_out_region(self):
+        self.transform_region(region.comment)
 
     def complete(self, completion, prefix):
         # Clone the cursor
@@ -203,7 +315,7 @@ class Editor(QtWidgets.QPlainTextEdit):
         self.setTextCursor(cursor)
         self.completed = True
 
-    def find(self, text='', pos=None, comp=False, states={}, replaceCursor=True):
+    def find(self, text='', states=None, backward=None, replace=None):
         # Check and get text if none was given
         if not text:
             states = {
@@ -211,76 +323,101 @@ class Editor(QtWidgets.QPlainTextEdit):
                 'fromStart': self.find_fromStart,
                 'wholeWord': self.find_wholeWord,
                 'backward': self.find_backward,
+                'regex': self.find_regex,
                 'find_text': self.find_text,
             }
             text, states, successful = FindDialog(states).exec_()
             if not successful:
-                return
+                return False
             self.find_caseSensitive = states['caseSensitive']
             self.find_fromStart = states['fromStart']
             self.find_wholeWord = states['wholeWord']
             self.find_backward = states['backward']
+            self.find_regex = states['regex']
             self.find_text = states['find_text']
-        elif not states:
+        elif states is None:
             states = {
-                'caseSensitive': False,
-                'wholeWord': False,
+                'caseSensitive': self.find_caseSensitive,
+                'wholeWord': self.find_wholeWord,
+                'backward': self.find_backward,
+                'regex': self.find_regex,
             }
+        if not text:
+            self.search.clear()
+            return False
+        if backward is None:
+            backward = bool(states.get('backward'))
+        self.find_text = text
+
+        # Index the matches, then pick the next (or previous) one by bisection
+        regex = bool(states.get('regex'))
+        try:
+            self.search.set_query(text, bool(states['caseSensitive']),
+                                  bool(states['wholeWord']), regex)
+        except re.error as error:
+            self.statusBar.showMessage('Bad regular expression: %s' % error)
+            return False
+        if self.search.searching:
+            # Regular expressions are searched for in a worker process; the
+            # search goes on when it is done
+            self.pendingFind = (text, states, backward, replace)
+            self.statusBar.showMessage('Searching for %s...' % text)
+            return False
+        cursor = self.textCursor()
+        if self.find_fromStart == QtCore.Qt.Checked:
+            # Only the first search starts from the start
+            self.find_fromStart = 1
+            span = self.search.previous(0) if backward else \
+                self.search.next(0)
+        elif backward:
+            span = self.search.previous(cursor.selectionStart())
+        else:
+            span = self.search.next(cursor.selectionEnd())
+        if span is None:
+            self.statusBar.showMessage('%s not found' % text)
+            return False
 
-        # If got text, then start finding
-        if text:
-            # Check there are occurences of the search text in the document.
-            do = 0
-            txt = text
-            all_text = self.toPlainText()
-            if not states['caseSensitive']:
-                all_text = all_text.lower()
-            if text in all_text: do = 1
-            if do and states['wholeWord']:
-                if not f' {txt} ' in all_text: do = 0
-            if not do and comp and states['replaceAll']: states['backward'] = 1
-            if do:
-                self.find_text = text
-
-                # Start search from cursor pos if no pos is given
-                if pos is None: pos = self.textCursor().position()
-
-                # Make options
-                flags = QtGui.QTextDocument.FindFlag(0)
-                if self.find_caseSensitive or comp and (states and states['caseSensitive']):
-                    flags |= QtGui.QTextDocument.FindCaseSensitively
-                if self.find_wholeWord or comp and (states and states['wholeWord']):
-                    flags |= QtGui.QTextDocument.FindWholeWords
-                if self.find_backward or comp and (states and states['backward']):
-                    flags |= QtGui.QTextDocument.FindBackward
-
-                # Find text
-                if self.find_fromStart is 2 or comp and (states and states['replaceAll']):
-                    cursor = self.document().find(self.find_text, 0, flags)
-                    self.find_fromStart = 1
-                else:
-                    cursor = self.document().find(self.find_text, pos, flags)
-
-                # Move cursor
-                if replaceCursor:
-                    self.setTextCursor(cursor)
-
-                # Return search result
-                if cursor.hasSelection():
-                    return True
-                else:
-                    # Otherwise try searching from the beginning of the document
-                    if comp: return False
-                    return self.find(text, 0, comp, states)
-            elif comp: return False
+        cursor.setPosition(span[0])
+        cursor.setPosition(span[1], cursor.KeepAnchor)
+        self.setTextCursor(cursor)
+        message = '%s of %s' % (self.search.index(span[0]) + 1,
+                                len(self.search))
+        if replace is not None:
+            if regex:
+                # The template is expanded in a worker process too, where
+                # the whole document is matched again so that lookarounds
+                # and anchors see the context the search saw
+                self.replace_match(cursor, replace, message)
+                self.statusBar.showMessage('Replacing %s...' % message)
+                return True
+            self.insertPlainText(replace)
+            message = 'Replaced ' + message
+        self.statusBar.showMessage(message)
+        return True
+
+    def findPending(self):
+        # Go on with a find that waited for a regex search
+        if self.pendingFind:
+            args, self.pendingFind = self.pendingFind, None
+            self.find(*args)
+
+    def foldedLines(self):
+        # Return the numbers of the lines heading folded regions
+        return self.folds.folded()
 
     def getWordUnderCursor(self, position=False):
+        # Read the line around the cursor, at most longLine characters of it
         cursor = self.textCursor()
-        cursor.select(cursor.LineUnderCursor)
+        block = cursor.block()
+        column = cursor.positionInBlock()
+        start = max(0, column - self.longLine // 2)
+        end = min(block.length() - 1, start + self.longLine)
+        cursor.setPosition(block.position() + start)
+        cursor.setPosition(block.position() + end, cursor.KeepAnchor)
 
         # Get the word under the cursor
         line = cursor.selectedText()
-        pos = self.textCursor().positionInBlock() - 1
+        pos = column - start - 1
 
         # Make sure that the lines has text and the text at pos isn't blank
         if line and line[pos].strip():
@@ -291,21 +428,63 @@ class Editor(QtWidgets.QPlainTextEdit):
                 return word, pos
             return word
 
-    def goto_line(self):
-        line, ok = QtWidgets.QInputDialog.getInt(self, "Goto", "Go to Line number:")
-        if ok:
-            self.moveCursor(QtGui.QTextCursor.Start)
-            for _ in range(line - 1):
-                self.moveCursor(QtGui.QTextCursor.Down)
+    def goto_line(self, line=None):
+        # Jump straight to the line's block, without walking the lines before
+        if line is None:
+            line, ok = QtWidgets.QInputDialog.getInt(self, "Goto",
+                "Go to Line number:", self.textCursor().blockNumber() + 1,
+                1, self.blockCount())
+            if not ok:
+                return
+        block = self.document().findBlockByNumber(
+            min(max(line, 1), self.blockCount()) - 1)
+        cursor = self.textCursor()
+        cursor.setPosition(block.position())
+        self.setTextCursor(cursor)
+        self.centerCursor()
+
+    def goto_symbol(self):
+        # Pick a def or class from the symbol index and jump to its line
+        line = SymbolDialog(self.symbols.symbols(), self).exec_()
+        if line is not None:
+            self.goto_line(line + 1)
 
     def highlight(self):
-        objects = []
-        objects += [self.highlight_current_line()]
-        self.setExtraSelections(objects)
+        self.updateExtraSelections()
 
         # Remove tooltips (? always)
         QtWidgets.QToolTip.hideText()
 
+    def highlight_matches(self):
+        # Selections for the search matches in the viewport only
+        if not len(self.search):
+            return []
+        matchColor = QtGui.QColor("#f0c040")
+        matchColor.setAlpha(110)
+        return [self.makeSelection(start, end, matchColor)
+                for start, end in self.search.spans(*self.visibleRange())]
+
+    def highlight_occurrences(self):
+        # Selections for the occurrences of the selected word in the
+        # viewport only
+        if not self.occurrenceWord:
+            return []
+        pattern = find_pattern(self.occurrenceWord, True, True)
+        occurrenceColor = QtGui.QColor("#858585")
+        occurrenceColor.setAlpha(60)
+        selections = []
+        start, end = self.visibleRange()
+        block = self.document().findBlock(start)
+        while block.isValid() and block.position() <= end:
+            text = block.text()
+            for first, last in utf16_spans(text, [
+                    match.span() for match in pattern.finditer(text)],
+                    block.position()):
+                selections.append(
+                    self.makeSelection(first, last, occurrenceColor))
+            block = block.next()
+        return selections
+
     def highlight_current_line(self):
         selection = QtWidgets.QTextEdit.ExtraSelection()
         lineColor = QtGui.QColor("#858585")
@@ -317,98 +496,17 @@ class Editor(QtWidgets.QPlainTextEdit):
         selection.cursor.clearSelection()
         return selection
 
-    def dent_region(self, dent):
-        # Load required variables
-        pos = self.textCursor().position()
-        cursor = self.textCursor()
-
-        # Start edit block
-        cursor.beginEditBlock()
-
-        # One-line dent
-        if not cursor.hasSelection():
-            # Move position and run operation
-            cursor.movePosition(cursor.StartOfLine)
-
-            # Apply the relevant action on the text
-            if dent == 'in':
-                # Add 4 spaces (equiv. to a tab)
-                cursor.insertText(' ' * 4)
-                add = 4
-            else:
-                # Strip first <= 4 spaces from block
-                text = cursor.block().text()
-                if not text[:4].strip():
-                    dedent = 4
-                else:
-                    dedent = len(text) - len(text.strip())
-                add = -dedent
-                cursor.movePosition(cursor.EndOfLine, cursor.KeepAnchor)
-                cursor.insertText(text[dedent:])
-
-            # Reset cursor state
-            cursor.setPosition(pos + add)
-
-        else:  # Multi-line dent
-            # Get selection positions
-            start = cursor.selectionStart()
-            end = cursor.selectionEnd()
-            selection = cursor.selection().toPlainText()
-
-            # Move to appropriate position for operation
-            cursor.setPosition(start)
-
-            # Iterate through all of the lines in the selection
-            sub = 0
-            for pos, line in enumerate(selection.split('\n')):
-                if dent == 'in':
-                    # Add 4 spaces to the beginning of the line
-                    cursor.movePosition(cursor.StartOfLine)
-                    cursor.insertText(' ' * 4)
-                    add = 4
-                else:
-                    # Remove 4 (or less if there aren't that many) spaces
-                    text = cursor.block().text()
-                    if not text[:4].strip():
-                        dedent = 4
-                    else:
-                        dedent = len(text) - len(text.strip())
-
-                    # Set variables that are needed for resetting cursor pos
-                    if pos == 0:
-                        add = -dedent
-                    sub += dedent
-
-                    # Move position
-                    cursor.movePosition(cursor.StartOfLine)
-                    cursor.movePosition(cursor.EndOfLine, cursor.KeepAnchor)
-
-                    # Change the text
-                    cursor.insertText(text[dedent:])
-
-                # Move one line down if needed
-                if pos != len(selection.split('\n')) - 1:
-                    cursor.movePosition(cursor.Down)
-
-            # Reset to original position
-            length = len(selection.split('\n'))
-            cursor.setPosition(start + add)
-            if dent == 'in':
-                cursor.setPosition(end + add * length, cursor.KeepAnchor)
-            else:
-                cursor.setPosition(end - sub, cursor.KeepAnchor)
-
-        # End edit block
-        cursor.endEditBlock()
-
-        # Reset our cursor
-        self.setTextCursor(cursor)
-
     def indent_region(self):
-        self.dent_region('in')
+        self.transform_region(region.indent)
 
     def dedent_region(self):
-        self.dent_region('de')
+        self.transform_region(region.dedent)
+
+    def insertFromMimeData(self, source):
+        # Every paste and drop comes through here, including Ctrl+V, which
+        # Qt handles without calling paste()
+        with self.bulkEdit():
+            super(Editor, self).insertFromMimeData(source)
 
     def isInTemplate(self):
         find = self.toPlainText().find('<', self.templateStart)
@@ -429,7 +527,6 @@ class Editor(QtWidgets.QPlainTextEdit):
         """Handle key-press events"""
         pos = self.textCursor().position()
         text = event.text()
-        last = self.document().findBlock(pos).text().strip()
         completer_isVisible = self.completer.popup().isVisible()
 
 
@@ -462,6 +559,11 @@ class Editor(QtWidgets.QPlainTextEdit):
                 self.inTemplate = False
                 return
 
+        # Escape stops highlighting the search matches
+        if text == u'\x1b' and len(self.search):
+            self.search.clear()
+            return
+
         if self.selectedBraces:
             cursor = self.textCursor()
             cursor.clearSelection()
@@ -495,7 +597,7 @@ class Editor(QtWidgets.QPlainTextEdit):
 
         # Insert spaces instead of tabs
         elif text == '\t':
-            if not completed:
+            if not completed and self.features['completion']:
                 self.autocomplete()
             else:
                 self.textCursor().beginEditBlock()
@@ -504,63 +606,33 @@ class Editor(QtWidgets.QPlainTextEdit):
             return
 
         elif text in ['\r', '\n']:
-            space = ''
-            hasBrace = False
-            subtract = 0
-
-            # Add spaces for when cursor is in a brace that is not opened/closed
-            char_pos = pos - len(last)
-            ind_pos = 0
-            for char in last:
-                if char in '([{}])':
-                    close = False if char in '([{' else True
-                    if not self.matchBraces(char, char_pos, close):
-                        ind_pos += 1
-                    else:
-                        # Check if the braces are in the same line
-                        findpos = self.matchBraces(char, char_pos, close)
-                        contains = self.textCursor().block().contains
-                        if contains(findpos[0]) + contains(findpos[1]) != 2:
-                            # If not, remove the indentation
-                            subtract -= 4
-                char_pos += 1
-            if ind_pos:
-                space += ' ' * (4 * ind_pos)
-                hasBrace = True
-
-            if last:
-                char = last[-1]
-
-                if char == ':':
-                    space += ' ' * 4
-
-                if not hasBrace and char == '\\':
-                    # Add extra spaces if there is a \ at the end of the line
-                    space += ' ' * 4
-
-            # Add last line's tabs to this line (keep indentation)
-            line = self.document().findBlock(pos).text()
-            if line.rstrip():
-                space += ' ' * (len(line) - len(line.strip()))
-            else:
-                for i in range(len(line)):
-                    self.textCursor().deletePreviousChar()
-
-            # Dedent if last word is one of the block-ending words
-            if last in ['break', 'continue', 'pass', 'yield']:
-                space = space[:-4]
-
-            if subtract:
-                space = space[:subtract]
-
-            # Insert text and space
-            super(Editor, self).keyPressEvent(event)
-            self.insertPlainText(space)
+            # Indent the new line the way IDLE does (see IndentEngine)
+            tc = self.textCursor()
+            tc.beginEditBlock()
+            tc.removeSelectedText()
+            indent = self.indenter.newline_indent(tc.block(),
+                                                  tc.positionInBlock())
+
+            # Clear a line of only whitespace, and drop the whitespace that
+            # would start the new line
+            if not tc.block().text()[:tc.positionInBlock()].strip():
+                tc.movePosition(QtGui.QTextCursor.StartOfBlock,
+                                QtGui.QTextCursor.KeepAnchor)
+                tc.removeSelectedText()
+            rest = tc.block().text()[tc.positionInBlock():]
+            tc.movePosition(QtGui.QTextCursor.Right,
+                            QtGui.QTextCursor.KeepAnchor,
+                            len(rest) - len(rest.lstrip(' \t')))
+            tc.insertText('\n' + ' ' * indent)
+            tc.endEditBlock()
+            self.setTextCursor(tc)
             return
 
         # Show brace formatting
         elif text and text in '([{}])':
             super(Editor, self).keyPressEvent(event)
+            if not self.features['braces']:
+                return
             if text in '([{':
                 self.matchBraces(text, pos, highlight=True)
             if text in ')]}':
@@ -602,85 +674,162 @@ class Editor(QtWidgets.QPlainTextEdit):
         if not self.textCursor().hasSelection() and self.selectedBraces:
             self.selectedBraces = 0
 
+    def makeSelection(self, start, end, color):
+        selection = QtWidgets.QTextEdit.ExtraSelection()
+        selection.format.setBackground(color)
+        selection.cursor = QtGui.QTextCursor(self.document())
+        selection.cursor.setPosition(start)
+        selection.cursor.setPosition(end, selection.cursor.KeepAnchor)
+        return selection
+
     def matchBraces(self, brace, pos, close=False, highlight=False, select=1):
-        if not close:
-            searchText = self.toPlainText()[pos + 1:]
-            other = {'(': ')', '[': ']', '{': '}', '<': '>'}.get(brace)
+        if brace in '<>':
+            # Template fields are not indexed, so scan the text for them
+            newpos = self.scanBraces(brace, pos, close)
+        elif self.document().findBlock(pos).length() - 1 > self.longLine:
+            # Long lines are left out of the index (see set_long_line)
+            newpos = self.scanBraces(brace, pos, close)
         else:
-            searchText = self.toPlainText()[:pos][::-1]
-            other = {')': '(', ']': '[', '}': '{', '>': '<'}.get(brace)
-        level = 0  # for if there are other open/close brackets
-        for char in enumerate(searchText):
-            if char[1] == other:
-                if level:
-                    # We found the opposite brace, but for another open brace
-                    level -= 1
-                else:
-                    # We found the opposite brace for the original brace
-                    newpos = pos - 1 - char[0] if close else pos + 1 + char[0]
-                    position = (newpos, pos) if close else (pos, newpos)
-                    if not highlight:
-                        return position
-                    cursor = self.textCursor()
-                    cursor.setPosition(position[0])
-                    cursor.setPosition(position[1] + 1, cursor.KeepAnchor)
-                    self.setTextCursor(cursor)
-                    if select:
-                        self.selectedBraces = True
-                    return position
-            elif char[1] == brace:
-                # If there is another identical brace, increment level
-                level += 1
-        return
+            # Brackets in strings and comments are left out of the index
+            newpos = self.highlighter.brackets.match(pos)
+        if newpos is None:
+            return
 
-    def lineAreaPaintEvent(self, event):
-        # Draw gutter area
-        painter = QtWidgets.QPainter(self.lineArea)
-        painter.fillRect(event.rect(), QtGui.QColor('#EEEEEE'))
+        position = (newpos, pos) if close else (pos, newpos)
+        if not highlight:
+            return position
+        cursor = self.textCursor()
+        cursor.setPosition(position[0])
+        cursor.setPosition(position[1] + 1, cursor.KeepAnchor)
+        self.setTextCursor(cursor)
+        if select:
+            self.selectedBraces = True
+        return position
 
-        # Match editor font
-        painter.setFont(self.font())
+    def lineAreaMousePressEvent(self, event):
+        # Clicking a line number folds or unfolds the region it heads
+        cursor = self.cursorForPosition(QtCore.QPoint(0, event.pos().y()))
+        self.toggle_fold(cursor.block())
 
-        # Calculate geometry
-        firstBlock = self.firstVisibleBlock()
-        blockNumber = firstBlock.blockNumber()
-        top = self.blockBoundingGeometry(firstBlock).\
+    def lineAreaPaintEvent(self, event):
+        # Draw gutter area, only where it is dirty (scrolling blits the rest)
+        rect = event.rect()
+        painter = QtGui.QPainter(self.lineArea)
+        painter.fillRect(rect, self.gutterColor)
+
+        # Calculate geometry; unless long lines are wrapped (see
+        # setLongLines), all lines share one height
+        block = self.firstVisibleBlock()
+        top = self.blockBoundingGeometry(block).\
               translated(self.contentOffset()).top()
-        bottom = top + self.blockBoundingRect(firstBlock).height()
-
-        # Draw line numbers
-        block = firstBlock
-        while block.isValid() and top <= event.rect().bottom():
-            if block.isVisible() and bottom >= event.rect().top():
-                num = str(blockNumber + 1)
-                painter.setPen(QtCore.Qt.black)
-                painter.drawText(3, top, self.lineArea.width(), \
-                                 self.fontMetrics().height(), \
-                                 QtCore.Qt.AlignLeft, num)
-
-            # Increment
-            block = block.next()
-            top = bottom
-            bottom = top + self.blockBoundingRect(block).height()
-            blockNumber = blockNumber + 1
+        height = self.blockBoundingRect(block).height()
+        wrapped = self.lineWrapMode() != self.NoWrap
+
+        # Draw the cached line numbers
+        while block.isValid() and top <= rect.bottom():
+            if block.isVisible():
+                if wrapped:
+                    height = self.blockBoundingRect(block).height()
+                if top + height >= rect.top():
+                    painter.drawPixmap(QtCore.QPointF(3, top),
+                        self.lineArea.pixmap(block.blockNumber() + 1))
+                top += height
+            block = self.nextVisibleBlock(block)
 
     def lineAreaWidth(self):
-        # Return a line number width of 4 chars
+        # Return a line number width of the last line's digits, 4 at least
         if self.enableLineNumbers:
-            fm = self.fontMetrics()
-            return 4 + fm.width('9') * 4
+            return 4 + self.lineArea.digitWidth * max(self.lineDigits, 4)
         else:
             return 0
 
+    def nextVisibleBlock(self, block):
+        # Jump over a folded region by line number instead of block by block
+        following = block.next()
+        if following.isValid() and not following.isVisible():
+            following = self.document().findBlockByLineNumber(
+                block.firstLineNumber() + block.lineCount())
+        return following
+
+    def overlayPaintEvent(self, event):
+        # Draw the column line, the indentation guides and the marks of
+        # folded lines in one pass over the blocks in the dirty rect
+        rect = event.rect()
+        painter = QtGui.QPainter(self.viewport())
+        fm = self.fontMetrics()
+        space = fm.width(' ')
+        left = self.contentOffset().x() + self.document().documentMargin()
+        color = QtGui.QColor(self.textColor)
+        if self.enableColumnLine:
+            color.setAlpha(80)
+            painter.fillRect(QtCore.QRectF(left + space * 80, rect.top(),
+                                           1, rect.height()), color)
+
+        # Calculate geometry; unless long lines are wrapped (see
+        # setLongLines), all lines share one height
+        block = self.firstVisibleBlock()
+        top = self.blockBoundingGeometry(block).\
+              translated(self.contentOffset()).top()
+        height = self.blockBoundingRect(block).height()
+        wrapped = self.lineWrapMode() != self.NoWrap
+
+        # A guide for every level of indentation, with blank lines indented
+        # like the next line that isn't, and a box after each folded line
+        lines = []
+        boxes = []
+        step = IndentEngine.indent_width
+        blank = None
+        while block.isValid() and top <= rect.bottom():
+            if block.isVisible():
+                if wrapped:
+                    height = self.blockBoundingRect(block).height()
+                if top + height >= rect.top():
+                    if self.enableIndentGuides:
+                        width = self.indentLevels.width(block)
+                        if width >= 0:
+                            blank = None
+                        elif blank is not None:
+                            width = blank
+                        else:
+                            following = block.next()
+                            while width < 0 and following.isValid():
+                                width = self.indentLevels.width(following)
+                                following = following.next()
+                            blank = width
+                        for column in range(0, width, step):
+                            x = left + column * space
+                            lines.append(QtCore.QLineF(x, top, x, top + height))
+                    if self.folds.is_folded(block):
+                        x = left + fm.width(block.text()) + space
+                        boxes.append(QtCore.QRectF(x, top + 1, space * 3,
+                                                   height - 2))
+                top += height
+            block = self.nextVisibleBlock(block)
+        color.setAlpha(40)
+        painter.setPen(color)
+        painter.drawLines(lines)
+        color.setAlpha(120)
+        painter.setPen(color)
+        for box in boxes:
+            painter.drawRect(box)
+            painter.drawText(box, '...',
+                             QtGui.QTextOption(QtCore.Qt.AlignCenter))
+
+    def paintEvent(self, event):
+        super(Editor, self).paintEvent(event)
+        self.overlayPaintEvent(event)
+
     def paste_reverse(self):
         cb = QtWidgets.QApplication.clipboard().text()
-        self.insertPlainText(' '.join(cb.split(' ')[::-1]))
+        with self.bulkEdit():
+            self.insertPlainText(' '.join(cb.split(' ')[::-1]))
 
     def replace(self):
         states = {
             'caseSensitive': self.replace_caseSensitive,
             'wholeWord': self.replace_wholeWord,
             'backward': self.replace_backward,
+            'regex': self.replace_regex,
             'replace_text': self.replace_text,
             'replace_with': self.replace_with,
         }
@@ -692,39 +841,147 @@ class Editor(QtWidgets.QPlainTextEdit):
         self.replace_caseSensitive = states['caseSensitive']
         self.replace_wholeWord = states['wholeWord']
         self.replace_backward = states['backward']
+        self.replace_regex = states['regex']
         self.replace_text = states['replace_text']
         self.replace_with = states['replace_with']
 
-        text = self.toPlainText()
         if not successful or not states['replaceAll']: # If not successful, Enter was pressed.
             # Just replace one ocurrence
-            found = self.find(find, None, True, states)
-            if found:
-                self.insertPlainText(replace)
+            self.find(find, states, replace=replace)
             # keep dialog alive
         elif successful and states['replaceAll']:
-            # Use regex to replace all occurrences
-            text = re.sub(
-                re.escape(find), re.escape(replace), self.toPlainText(),
-                re.U if self.replace_caseSensitive else re.I|re.U
-            )
+            self.replace_all(find, replace, states)
 
-            # Replace old text
-            self.textCursor().beginEditBlock()
-            self.selectAll()
-            self.insertPlainText(text)
-            self.textCursor().endEditBlock()
+    def replace_all(self, find, replace, states):
+        # Replace every occurrence by editing only the matched ranges; a
+        # regular expression is matched in a worker process, and the edits
+        # are made when it is done
+        if not find:
+            return
+        try:
+            pattern = find_pattern(find, states['caseSensitive'],
+                                   states['wholeWord'], states.get('regex'))
+        except re.error as error:
+            self.statusBar.showMessage('Bad regular expression: %s' % error)
+            return
+        if states.get('regex'):
+            job = RegexJob(self.document(), pattern, replace, collect=True,
+                           parent=self)
+            job.batch.connect(self.replace_spans)
+            job.done.connect(job.deleteLater)
+            job.failed.connect(self.searchFailed)
+            job.failed.connect(job.deleteLater)
+            job.start()
+            self.statusBar.showMessage('Searching for %s...' % find)
+            return
+        text = self.toPlainText()
+        spans = utf16_spans(text, [match.span()
+                                   for match in pattern.finditer(text)])
+        self.replace_spans([(start, end, replace) for start, end in spans])
+
+    def replace_match(self, cursor, template, message):
+        # Replace the regex match a cursor selects with the template as the
+        # worker expanded it, unless the match has been edited meanwhile
+        cursor = QtGui.QTextCursor(cursor)
+        job = RegexJob(self.document(), self.search.pattern, template,
+                       collect=True, parent=self)
+
+        def replace(spans):
+            span = cursor.selectionStart(), cursor.selectionEnd()
+            for start, end, text in spans:
+                if (start, end) == span:
+                    break
+            else:
+                self.statusBar.showMessage('%s not replaced: the match has '
+                                           'changed' % self.find_text)
+                return
+            current = self.textCursor()
+            selected = (current.selectionStart(), current.selectionEnd())
+            cursor.insertText(text)
+            if selected == span:
+                self.setTextCursor(cursor)
+            self.statusBar.showMessage('Replaced ' + message)
+
+        job.batch.connect(replace)
+        job.done.connect(job.deleteLater)
+        job.failed.connect(self.searchFailed)
+        job.failed.connect(job.deleteLater)
+        job.start()
+
+    def replace_spans(self, spans):
+        # Replace the (start, end, text) spans, last first, in one edit block
+        # (one undo step)
+        cursor = QtGui.QTextCursor(self.document())
+        if spans:
+            with self.bulkEdit():
+                cursor.beginEditBlock()
+                for start, end, text in reversed(spans):
+                    cursor.setPosition(start)
+                    cursor.setPosition(end, cursor.KeepAnchor)
+                    cursor.insertText(text)
+                cursor.endEditBlock()
+        self.statusBar.showMessage('Replaced %s occurrence%s' % (
+            len(spans), '' if len(spans) == 1 else 's'))
 
     def resizeEvent(self, event):
+        super(Editor, self).resizeEvent(event)
         if self.enableLineNumbers:
             # Resize line area as well
-            super(Editor, self).resizeEvent(event)
             rect = self.contentsRect()
             self.lineArea.setGeometry(
                 QtCore.QRect(rect.left(), rect.top(),
                 self.lineAreaWidth(), rect.height())
             )
 
+    def scanBraces(self, brace, pos, close):
+        # Find the brace matching the one at pos by counting, reading at most
+        # longLine characters of text beside it
+        other = {'<': '>', '>': '<', '(': ')', ')': '(',
+                 '[': ']', ']': '[', '{': '}', '}': '{'}[brace]
+        cursor = self.textCursor()
+        if not close:
+            cursor.setPosition(pos + 1)
+            cursor.setPosition(min(pos + 1 + self.longLine,
+                                   self.document().characterCount() - 1),
+                               cursor.KeepAnchor)
+            searchText = cursor.selectedText()
+        else:
+            cursor.setPosition(pos)
+            cursor.setPosition(max(pos - self.longLine, 0), cursor.KeepAnchor)
+            searchText = cursor.selectedText()[::-1]
+        level = 0  # for if there are other open/close brackets
+        for index, char in enumerate(searchText):
+            if char == other:
+                if level:
+                    # We found the opposite brace, but for another one
+                    level -= 1
+                else:
+                    # We found the opposite brace for the original brace;
+                    # positions count UTF-16 code units
+                    skipped = len(searchText[:index].encode('utf-16-le')) // 2
+                    return pos - 1 - skipped if close else pos + 1 + skipped
+            elif char == brace:
+                # If there is another identical brace, increment level
+                level += 1
+
+    def searchFailed(self, message):
+        self.statusBar.showMessage('Search stopped: %s' % message)
+
+    def setFilename(self, filename):
+        # Highlight the file as its type; names are only analysed for Python
+        self.filename = filename
+        self.highlighter.set_filename(filename)
+        self.semantic.set_enabled(
+            self.features['semantic'] and
+            lexer_for_filename(self.filename).name == 'Python')
+
+    def setFoldedLines(self, numbers):
+        # Fold the regions headed by the given line numbers
+        for number in numbers:
+            block = self.document().findBlockByNumber(number)
+            if block.isValid():
+                self.folds.fold(block)
+
     def setFocus(self, isTemplate=False):
         super(Editor, self).setFocus()
         if isTemplate:
@@ -734,40 +991,257 @@ class Editor(QtWidgets.QPlainTextEdit):
     def setModified(self, modified):
         return self.document().setModified(modified)
 
+    def setPlainText(self, text):
+        # Pick the feature mode and lay long lines out wrapped from the start
+        self.setMetrics(measure(text))
+        # Lex big files in a worker process while the text is shown
+        if text.count('\n') >= self.backgroundLexLines:
+            self.highlighter.lex_in_background(text)
+        super(Editor, self).setPlainText(text)
+        self.measureTimer.stop()
+
+    def setMetrics(self, metrics):
+        # Wrap long lines and switch to the feature mode the document's
+        # size calls for, unless a mode is set for this editor
+        self.metrics = metrics
+        self.setLongLines(metrics.longest > self.longLine)
+        self.setMode(self.modeOverride or self.policy.mode(metrics))
+
+    def setMode(self, mode):
+        # Switch features on or off for a mode (see policy.FEATURES)
+        if mode == self.mode:
+            return
+        self.mode = mode
+        self.features = FEATURES[mode]
+        self.highlighter.set_plain(not self.features['highlighting'])
+        self.semantic.set_enabled(
+            self.features['semantic'] and
+            lexer_for_filename(self.filename).name == 'Python')
+        if not self.features['occurrences']:
+            self.occurrences.cancel()
+            self.occurrenceWord = None
+        self.updateExtraSelections()
+        if self.enableLineNumbers:
+            self.lineArea.update()
+        self.modeChanged.emit(mode)
+
+    def setModeOverride(self, mode):
+        # Keep this editor in a mode whatever its size, or follow the
+        # policy again if mode is None
+        self.modeOverride = mode
+        self.setMode(mode or self.policy.mode(self.metrics))
+
+    def setTheme(self, style):
+        # Highlight with a Pygments style, and take the colours of text the
+        # highlighter leaves unformatted (pending blocks, plain mode), of the
+        # gutter and of the overlay from it
+        self.highlighter.set_style(style)
+        self.textColor = QtGui.QColor(
+            '#' + (style.style_for_token(Token)['color'] or '000000'))
+        background = QtGui.QColor(style.background_color)
+        palette = self.palette()
+        palette.setColor(QtGui.QPalette.Text, self.textColor)
+        palette.setColor(QtGui.QPalette.Base, background)
+        self.setPalette(palette)
+        # Typed text takes its colour from the palette, so that it follows
+        # a later change of theme
+        format = self.currentCharFormat()
+        format.clearForeground()
+        self.setCurrentCharFormat(format)
+        self.gutterColor = background.darker(107) \
+            if background.lightness() > 127 else background.lighter(130)
+        if self.enableLineNumbers:
+            self.lineArea.pixmaps.clear()
+            self.lineArea.update()
+        self.viewport().update()
+
+    def setLongLines(self, present):
+        # Wrap lines while any is longer than longLine characters: Qt lays
+        # out and paints a line whole unless it is wrapped, and then only
+        # paints the rows on screen
+        mode = self.WidgetWidth if present else self.NoWrap
+        if self.lineWrapMode() != mode:
+            self.setLineWrapMode(mode)
+
+    def showOccurrenceCount(self, text, count):
+        # Only replace an older count, not other messages
+        message = self.statusBar.currentMessage()
+        if not message or message.startswith('Selection Duplicates Count'):
+            self.statusBar.showMessage(
+                'Selection Duplicates Count: %s ' % count)
+
+    def showOccurrences(self, text):
+        # Highlight the selected word's occurrences once the selection
+        # stays put
+        word = text if re.match(r'\w+$', text) else None
+        if word != self.occurrenceWord:
+            self.occurrenceWord = word
+            self.updateExtraSelections()
+
     def show_parens(self, yes):
         text = self.textCursor().selectedText()
         if yes and not self.hadSelection and not text == u'\u2029':
             self.hadSelection = True
-            if len(text) == 1 and text in '([{}])':
+            if len(text) == 1 and text in '([{}])' and self.features['braces']:
                 pos = self.textCursor().selectionStart()
                 self.matchBraces(text, pos, True if text in '}])' else False)
         elif yes:
             self.hadSelection = False
 
+    def strip_whitespace(self):
+        self.transform_region(region.strip, whole=True)
+
+    def tabify_region(self):
+        self.transform_region(region.tabify)
+
+    def toggle_fold(self, block=None):
+        # Fold or unfold the region of a line (the cursor's by default),
+        # keeping the cursor out of hidden lines
+        if block is None:
+            block = self.textCursor().block()
+        self.folds.toggle(block)
+        header = self.folds.header(self.textCursor().block())
+        if header != self.textCursor().block():
+            cursor = self.textCursor()
+            cursor.setPosition(header.position() + header.length() - 1)
+            self.setTextCursor(cursor)
+
+    def transform_region(self, transform, whole=False):
+        # Apply a line transform (see src/region.py) to the selected lines,
+        # the current line or the whole document, as a single undo step
+        document = self.document()
+        cursor = self.textCursor()
+        selected = cursor.hasSelection() and not whole
+        if whole:
+            first, last = document.firstBlock(), document.lastBlock()
+        else:
+            first = document.findBlock(cursor.selectionStart())
+            last = document.findBlock(cursor.selectionEnd())
+
+            # A selection that ends at the start of a line leaves it out
+            if last != first and cursor.selectionEnd() == last.position():
+                last = last.previous()
+        start = first.position()
+        line = cursor.blockNumber()
+        number = line - first.blockNumber()
+        column = cursor.positionInBlock()
+
+        # Transform the lines in one pass
+        edit = QtGui.QTextCursor(document)
+        edit.setPosition(start)
+        edit.setPosition(last.position() + last.length() - 1, edit.KeepAnchor)
+        lines = edit.selectedText().split(u'\u2029')
+        new = [transform(line) for line in lines]
+
+        # Only replace the lines from the first to the last that changed
+        if new != lines:
+            low = 0
+            while new[low] == lines[low]:
+                low += 1
+            high = len(lines)
+            while new[high - 1] == lines[high - 1]:
+                high -= 1
+            offset = start + sum(len(line) + 1 for line in lines[:low])
+            edit.setPosition(offset)
+            edit.setPosition(offset + sum(len(line) + 1
+                                          for line in lines[low:high]) - 1,
+                             edit.KeepAnchor)
+            with self.bulkEdit():
+                edit.beginEditBlock()
+                edit.insertText('\n'.join(new[low:high]))
+                edit.endEditBlock()
+
+        # Select the region again, or keep the cursor on its line
+        if selected:
+            cursor.setPosition(start)
+            cursor.setPosition(start + sum(len(line) + 1 for line in new) - 1,
+                               cursor.KeepAnchor)
+        else:
+            block = document.findBlockByNumber(line)
+            if 0 <= number < len(lines):
+                column += len(new[number]) - len(lines[number])
+            cursor.setPosition(block.position() +
+                               max(0, min(column, block.length() - 1)))
+        self.setTextCursor(cursor)
+
+    def uncomment_region(self):
+        self.transform_region(region.uncomment)
+
+    def unfold_all(self):
+        self.folds.unfold_all()
+
+    def unfoldCursor(self):
+        # Unfold the region the cursor has gone into
+        block = self.textCursor().block()
+        if not block.isVisible():
+            self.folds.unfold(self.folds.header(block))
+
+    def untabify_region(self):
+        self.transform_region(region.untabify)
+
+    def updateExtraSelections(self):
+        objects = []
+        if self.features['currentLine']:
+            objects.append(self.highlight_current_line())
+        objects += self.highlight_occurrences()
+        objects += self.highlight_matches()
+        self.setExtraSelections(objects)
+
+    def updateIndentGuides(self, position, removed, added):
+        # Blank lines take the guides of the line after them, so repaint
+        # them when the line after changes
+        if self.enableIndentGuides:
+            block = self.document().findBlock(position).previous()
+            if block.isValid() and not block.text().strip():
+                self.viewport().update()
+
+    def updateMetrics(self, position, removed, added):
+        # Wrap as soon as the edited line gets long; measure the text again
+        # after a pause if a big edit may change the feature mode, or long
+        # lines may have come or gone
+        if self.document().findBlock(position).length() - 1 > self.longLine:
+            self.setLongLines(True)
+        if added > self.longLine or removed > self.longLine or \
+                (removed and self.lineWrapMode() != self.NoWrap):
+            self.measureTimer.start()
+
     def updateLineArea(self, rect, dy):
         # Respond to a scroll event
-        if dy:
+        if dy and self.features['lazyGutter']:
+            self.lineAreaTimer.start()
+        elif dy:
             self.lineArea.scroll(0, dy)
         else:
             self.lineArea.update(0, rect.y(), self.lineArea.width(), rect.height())
-        if rect.contains(self.viewport().rect()):
-            self.updateLineAreaWidth()
 
-    def updateLineAreaWidth(self):
-        self.setViewportMargins(self.lineAreaWidth(), 0, 0, 0)
+    def updateLineAreaWidth(self, *args):
+        # Resize the gutter only when the line count gains or loses a digit
+        digits = len(str(self.blockCount()))
+        if digits != self.lineDigits:
+            self.lineDigits = digits
+            self.setViewportMargins(self.lineAreaWidth(), 0, 0, 0)
+            rect = self.contentsRect()
+            self.lineArea.setGeometry(
+                QtCore.QRect(rect.left(), rect.top(),
+                self.lineAreaWidth(), rect.height())
+            )
 
     def updateStatusBar(self):
-        lines = self.toPlainText().count('\n') + 1
+        lines = self.blockCount()
 
-        # Info on selection
+        # Info on selection, counted after a pause (see OccurrenceCounter)
         if self.textCursor().hasSelection():
-            text = self.toPlainText()
-            selection = self.textCursor().selectedText()
-            info = 'Selection Duplicates Count: ' + str(text.count(selection)) + ' '
-            self.statusBar.showMessage(info)
+            if self.features['occurrences']:
+                cursor = self.textCursor()
+                self.occurrences.count(cursor.selectionStart(),
+                                       cursor.selectionEnd())
         else:
             # Clear any message that might have been shown before
+            self.occurrences.cancel()
             self.statusBar.clearMessage()
+            if self.occurrenceWord:
+                self.occurrenceWord = None
+                self.updateExtraSelections()
 
         # The line number and column number
         message = 'Ln: %s/%s' % (self.textCursor().blockNumber() + 1, lines)
@@ -781,3 +1255,10 @@ class Editor(QtWidgets.QPlainTextEdit):
             self.setCursorWidth(self.origCursorWidth * 2)
         else:
             self.setCursorWidth(self.origCursorWidth)
+
+    def visibleRange(self):
+        # The (first, last) document positions of the blocks in the viewport
+        bottom = self.cursorForPosition(QtCore.QPoint(
+            self.viewport().width(), self.viewport().height())).block()
+        return (self.firstVisibleBlock().position(),
+                bottom.position() + bottom.length())
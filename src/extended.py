@@ -66,10 +66,14 @@ class FindDialog(QtWidgets.QDialog):
         self.backwardCheckBox = QtWidgets.QCheckBox("Search backward")
         if states['backward']:
             self.backwardCheckBox.setChecked(True)
+        self.regexCheckBox = QtWidgets.QCheckBox("Regular expression")
+        if states['regex']:
+            self.regexCheckBox.setChecked(True)
 
         extensionLayout = QtWidgets.QVBoxLayout()
         extensionLayout.addWidget(self.wholeWordsCheckBox)
         extensionLayout.addWidget(self.backwardCheckBox)
+        extensionLayout.addWidget(self.regexCheckBox)
         extension.setLayout(extensionLayout)
 
         topLeftLayout = QtWidgets.QHBoxLayout()
@@ -101,6 +105,7 @@ class FindDialog(QtWidgets.QDialog):
             'fromStart': self.fromStartCheckBox.checkState(),
             'wholeWord': self.wholeWordsCheckBox.checkState(),
             'backward': self.backwardCheckBox.checkState(),
+            'regex': self.regexCheckBox.checkState(),
             'find_text': self.lineEdit.text()
         }
         return self.lineEdit.text(), states, self._succesful
@@ -151,6 +156,9 @@ class ReplaceDialog(QtWidgets.QDialog):
         self.backwardCheckBox = QtWidgets.QCheckBox("Search backward")
         if states['backward']:
             self.backwardCheckBox.setChecked(True)
+        self.regexCheckBox = QtWidgets.QCheckBox("Regular expression")
+        if states['regex']:
+            self.regexCheckBox.setChecked(True)
 
         topLeftLayout = QtWidgets.QHBoxLayout()
         topLeftLayout.addWidget(label)
@@ -163,6 +171,7 @@ class ReplaceDialog(QtWidgets.QDialog):
         leftLayout.addWidget(self.caseSensitiveCheckBox)
         leftLayout.addWidget(self.wholeWordsCheckBox)
         leftLayout.addWidget(self.backwardCheckBox)
+        leftLayout.addWidget(self.regexCheckBox)
         leftLayout.addStretch(1)
 
         mainLayout = QtWidgets.QGridLayout()
@@ -182,6 +191,7 @@ class ReplaceDialog(QtWidgets.QDialog):
             'caseSensitive': self.caseSensitiveCheckBox.checkState(),
             'wholeWord': self.wholeWordsCheckBox.checkState(),
             'backward': self.backwardCheckBox.checkState(),
+            'regex': self.regexCheckBox.checkState(),
             'replace_text': self.find.text(),
             'replace_with': self.replace.text(),
             'replaceAll': False if self.buttonPressed == "Replace" else True,
@@ -192,6 +202,59 @@ class ReplaceDialog(QtWidgets.QDialog):
         if args[0]: self.buttonPressed = args[0].text()
 
 
+class SymbolDialog(QtWidgets.QDialog):
+
+    def __init__(self, symbols, parent=None):
+        super(SymbolDialog, self).__init__(parent)
+        self.symbols = symbols
+
+        # Filtering is left to a proxy model so that it stays quick with
+        # tens of thousands of symbols
+        self.model = QtCore.QSortFilterProxyModel(self)
+        self.model.setSourceModel(QtCore.QStringListModel(
+            ["%s %s  (%d)" % (kind, name, line + 1)
+             for line, name, kind in symbols], self))
+        self.model.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+
+        self.lineEdit = QtWidgets.QLineEdit()
+        self.lineEdit.textChanged.connect(self.filter)
+        self.lineEdit.returnPressed.connect(self.accept)
+        self.lineEdit.installEventFilter(self)
+        self.listView = QtWidgets.QListView()
+        self.listView.setUniformItemSizes(True)
+        self.listView.setModel(self.model)
+        self.listView.activated.connect(self.accept)
+        self.listView.setCurrentIndex(self.model.index(0, 0))
+
+        mainLayout = QtWidgets.QVBoxLayout()
+        mainLayout.addWidget(self.lineEdit)
+        mainLayout.addWidget(self.listView)
+        self.setLayout(mainLayout)
+        self.setWindowTitle("Go to Symbol")
+
+    def eventFilter(self, obj, event):
+        # Up and down in the filter move through the list
+        if event.type() == QtCore.QEvent.KeyPress and \
+                event.key() in (QtCore.Qt.Key_Up, QtCore.Qt.Key_Down):
+            self.listView.keyPressEvent(event)
+            return True
+        return super(SymbolDialog, self).eventFilter(obj, event)
+
+    def exec_(self):
+        # Returns the line of the chosen symbol, or None
+        if not super(SymbolDialog, self).exec_():
+            return None
+        index = self.listView.currentIndex()
+        if not index.isValid():
+            return None
+        return self.symbols[self.model.mapToSource(index).row()][0]
+
+    def filter(self, text):
+        # Show the symbols containing the text, ignoring case
+        self.model.setFilterFixedString(text)
+        self.listView.setCurrentIndex(self.model.index(0, 0))
+
+
 class MenuBar(QtWidgets.QMenuBar):
 
     def focusOutEvent(self, event):
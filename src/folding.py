@@ -0,0 +1,150 @@
+#
+#  folding.py
+#
+from src.highlighter import in_string
+
+
+class FoldEngine(object):
+    """ Folds the indented region after a line away by hiding its blocks.
+
+        A region is headed by a line that the next lines are indented past,
+        like a def, a class or any other block statement, and runs up to the
+        next line indented no more than the header. Blank lines do not end
+        a region, and lines starting inside a string or brackets are folded
+        with the line they continue. The widths come from an IndentLevels
+        cache, the strings from the highlighter's block states and the
+        brackets from its bracket index, so only the region's own lines are
+        read.
+
+        Folded blocks are set invisible, so QPlainTextEdit neither lays out
+        nor paints them. An edit that touches a folded header or its hidden
+        lines unfolds it first.
+    """
+
+    def __init__(self, document, levels, brackets):
+        self._document = document
+        self._levels = levels
+        self._brackets = brackets
+        document.contentsChange.connect(self._contents_change)
+
+    def fold(self, block):
+        """ Folds the region a block heads, returning whether it has one.
+        """
+        last = self.region(block)
+        if last is None:
+            return False
+        first = following = block.next()
+        while True:
+            following.setVisible(False)
+            if following == last:
+                break
+            following = following.next()
+        self._relayout(first, last)
+        return True
+
+    def folded(self):
+        """ Returns the numbers of the folded header blocks.
+        """
+        numbers = []
+        block = self._document.firstBlock()
+        while block.isValid():
+            following = block.next()
+            if following.isValid() and block.isVisible() and \
+                    not following.isVisible():
+                numbers.append(block.blockNumber())
+            block = following
+        return numbers
+
+    def header(self, block):
+        """ Returns the header of the fold hiding a block, or the block
+        itself if it is visible.
+        """
+        while not block.isVisible() and block.previous().isValid():
+            block = block.previous()
+        return block
+
+    def is_folded(self, block):
+        """ Whether a block heads a folded region.
+        """
+        following = block.next()
+        return following.isValid() and not following.isVisible() and \
+            block.isVisible()
+
+    def region(self, block):
+        """ Returns the last block of the region a block heads, or None.
+        """
+        width = self._levels.width(block)
+        if width < 0 or in_string(block.previous()):
+            return None
+        last = None
+        following = block.next()
+        while following.isValid():
+            level = self._levels.width(following)
+            if level < 0:
+                pass
+            elif in_string(following.previous()) or (level <= width and
+                    self._brackets.enclosing(following.position()) is not None):
+                # A line continuing a string or brackets belongs to the
+                # region once it has begun, whatever its indentation
+                if last is not None:
+                    last = following
+            elif level > width:
+                last = following
+            else:
+                break
+            following = following.next()
+        return last
+
+    def toggle(self, block):
+        """ Unfolds the fold a block is in or heads, or else folds the region
+        the block heads.
+        """
+        block = self.header(block)
+        if self.is_folded(block):
+            self.unfold(block)
+        else:
+            self.fold(block)
+
+    def unfold(self, block):
+        """ Shows the hidden blocks after a header block.
+        """
+        first = following = block.next()
+        last = None
+        while following.isValid() and not following.isVisible():
+            following.setVisible(True)
+            last = following
+            following = following.next()
+        if last is not None:
+            self._relayout(first, last)
+
+    def unfold_all(self):
+        """ Shows every hidden block.
+        """
+        block = self._document.firstBlock()
+        while block.isValid():
+            if self.is_folded(block):
+                self.unfold(block)
+            block = block.next()
+
+    #---------------------------------------------------------------------------
+    # Protected interface
+    #---------------------------------------------------------------------------
+
+    def _contents_change(self, position, removed, added):
+        """ Unfolds a fold whose header or hidden lines were edited.
+        """
+        block = self._document.findBlock(position)
+        if not block.isValid():
+            return
+        if not block.isVisible() or self.is_folded(block):
+            self.unfold(self.header(block))
+
+    def _relayout(self, first, last):
+        """ Lays the blocks from first to last out again.
+        """
+        # Going to the layout directly, rather than through
+        # QTextDocument.markContentsDirty, keeps the document from reporting
+        # a contents change to the highlighter and the indexes
+        start = first.position()
+        length = last.position() + last.length() - start
+        self._document.documentLayout().documentChanged(start, length, length)
@@ -1,201 +1,227 @@
 #
 #  highlighter.py
 #
+import hashlib
+from collections import OrderedDict
+from sys import getsizeof
+from time import perf_counter
 from PySide2 import QtCore, QtGui
 from src.styles import PythonStyle
-from pygments.token import Token
+from src.brackets import BracketIndex, bracket_entry
+from src.diskcache import HighlightCache
+from src.lexer import HighlightLexer, lexer_for_filename
+from src.worker import ProcessJob
+from pygments.token import Text, string_to_tokentype
 
 # The code below has been taken from IPython's pygments_highlighter.py
-from pygments.formatters.html import HtmlFormatter
-from pygments.lexer import RegexLexer, _TokenType, Text, Error
-from pygments.lexers import PythonLexer
-from pygments.styles import get_style_by_name
 
 
-def get_tokens_unprocessed(self, text, stack=('root',)):
-    """ Split ``text`` into (tokentype, text) pairs.
+# Every distinct syntax stack is interned and given a stable integer, which is
+# used as the block state. Qt stops re-highlighting at the first block whose
+# state is unchanged, so edits only re-lex until the stacks line up again.
+# The state is also the only per-block storage: identical blocks share one
+# immutable stack tuple and no block carries user data.
+_syntax_stacks = [('root',)]
+_block_states = {('root',): 0}
 
-        Monkeypatched to store the final stack on the object itself.
-    """
-    pos = 0
-    tokendefs = self._tokens
-    tokens = self.tokens
-    keywords = tokens['keywords'][0][0].words
-    if 'Python' in self.name and not 'from' in keywords:
-        keywords += ('from',)
-    if hasattr(self, '_saved_state_stack'):
-        statestack = list(self._saved_state_stack)
-    else:
-        statestack = list(stack)
-    statetokens = tokendefs[statestack[-1]]
-    while 1:
-        for rexmatch, action, new_state in statetokens:
-            m = rexmatch(text, pos)
-            if m:
-                if type(action) is _TokenType:
-                    if m.group() in keywords:
-                        action = Token.Keyword
-                    elif m.group() in tokens['builtins'][0][0].words:
-                        action = Token.Name.Builtin
-                    yield pos, action, m.group()
-                elif action:
-                    for item in action(self, m):
-                        yield item
-                pos = m.end()
-                if new_state is not None:
-                    # state transition
-                    if isinstance(new_state, tuple):
-                        for state in new_state:
-                            if state == '#pop':
-                                statestack.pop()
-                            elif state == '#push':
-                                statestack.append(statestack[-1])
-                            else:
-                                statestack.append(state)
-                    elif isinstance(new_state, int):
-                        # pop
-                        del statestack[new_state:]
-                    elif new_state == '#push':
-                        statestack.append(statestack[-1])
-                    else:
-                        assert False, "wrong state def: %r" % new_state
-                    statetokens = tokendefs[statestack[-1]]
-                break
-        else:
-            try:
-                if text[pos] == '\n':
-                    # at EOL, reset state to "root"
-                    pos += 1
-                    statestack = ['root']
-                    statetokens = tokendefs['root']
-                    yield pos, Text, u'\n'
-                    continue
-                yield pos, Error, text[pos]
-                pos += 1
-            except IndexError:
-                break
-    self._saved_state_stack = list(statestack)
-
-# Monkeypatch!
-RegexLexer.get_tokens_unprocessed = get_tokens_unprocessed
-
-
-class PygmentsBlockUserData(QtGui.QTextBlockUserData):
-    """ Storage for the user data associated with each line.
+# State of a block that lazy highlighting has not lexed yet
+PENDING_STATE = -2
+
+# QSyntaxHighlighter re-highlights each change through this connection, which
+# bulk edits take down (see PygmentsHighlighter.suspend)
+_contents_change = QtCore.SIGNAL('contentsChange(int,int,int)')
+_reformat_blocks = QtCore.SLOT('_q_reformatBlocks(int,int,int)')
+
+
+def state_for_stack(stack):
+    """ Returns the interned block state for a syntax stack.
     """
+    stack = tuple(stack)
+    state = _block_states.get(stack)
+    if state is None:
+        state = _block_states[stack] = len(_syntax_stacks)
+        _syntax_stacks.append(stack)
+    return state
 
-    syntax_stack = ('root',)
 
-    def __init__(self, **kwds):
-        for key, value in kwds.items():
-            setattr(self, key, value)
-        QtGui.QTextBlockUserData.__init__(self)
+def stack_for_state(state):
+    """ Returns the syntax stack for a block state (-1 is an unlexed block).
+    """
+    if state < 0:
+        return _syntax_stacks[0]
+    return _syntax_stacks[state]
 
-    def __repr__(self):
-        attrs = ['syntax_stack']
-        kwds = ', '.join([ '%s=%r' % (attr, getattr(self, attr))
-                           for attr in attrs ])
-        return 'PygmentsBlockUserData(%s)' % kwds
 
+def in_string(block):
+    """ Whether the highlighter has a block ending inside a string (never
+    for an invalid or unlexed block).
+    """
+    state = block.userState()
+    return block.isValid() and state >= 0 and \
+        len(stack_for_state(state)) > 1
 
-class PygmentsHighlighter(QtGui.QSyntaxHighlighter):
-    """ Syntax highlighter that uses Pygments for parsing. """
 
-    #---------------------------------------------------------------------------
-    # 'QSyntaxHighlighter' interface
-    #---------------------------------------------------------------------------
+def grow_range(changed, position, removed, added):
+    """ Returns a [start, end) range of changed characters, or None, grown
+    by a contentsChange; the end follows the text moved by the change.
+    """
+    if changed is None:
+        return position, position + added
+    start, end = changed
+    if end > position:
+        end += added - removed
+    return min(start, position), max(end, position + added)
+
+
+def lex_lines(emit, text, filename, cache_key=None, batch_size=2000):
+    """ Lexes text line by line in a worker process (see ProcessJob), with
+    the lexer for filename.
+
+        Emits (first line number, token names, [(runs, exit stack), ...])
+        batches. So that they pickle cheaply, the runs are flat tuples of
+        (index into token names, length) pairs. With a cache_key, the lines
+        are also written to the on-disk highlight cache.
+    """
+    lexer = lexer_for_filename(filename)
+    stack = ('root',)
+    names = {}
+    first = 0
+    lines = []
+    cached = []
+    for line in text.split('\n'):
+        runs, stack = lexer.lex(stack, line)
+        flat = []
+        for token, length in runs:
+            index = names.get(token)
+            if index is None:
+                index = names[token] = len(names)
+            flat += (index, length)
+        lines.append((tuple(flat), stack))
+        if len(lines) == batch_size:
+            emit((first, ['.'.join(token) for token in names], lines))
+            first += len(lines)
+            cached += lines
+            lines = []
+    if lines:
+        emit((first, ['.'.join(token) for token in names], lines))
+        cached += lines
+    if cache_key is not None:
+        HighlightCache().store(
+            cache_key, ['.'.join(token) for token in names], cached)
+
+
+_tokens_by_name = {}
+
+# Formats record the id of their token type in this property, so the format
+# ranges Qt keeps for each block double as its token runs (see set_style)
+TOKEN_PROPERTY = QtGui.QTextFormat.UserProperty + 1
+_token_ids = {}
+_tokens_by_id = []
+
+
+def token_id(token):
+    """ Returns the interned id of a token type.
+    """
+    index = _token_ids.get(token)
+    if index is None:
+        index = _token_ids[token] = len(_tokens_by_id)
+        _tokens_by_id.append(token)
+    return index
 
-    def __init__(self, parent, lexer=None):
-        super(PygmentsHighlighter, self).__init__(parent)
 
-        self._document = self.document()
-        self._formatter = HtmlFormatter(nowrap=True)
-        self._lexer = lexer if lexer else PythonLexer()
-        self.set_style(PythonStyle)
-        self.setDocument(parent.document())
+def token_for_name(name):
+    """ Returns the token type for a name made by lex_lines.
+    """
+    token = _tokens_by_name.get(name)
+    if token is None:
+        token = _tokens_by_name[name] = string_to_tokentype(name)
+    return token
 
-    def highlightBlock(self, string):
-        """ Highlight a block of text.
-        """
-        prev_data = self.currentBlock().previous().userData()
-        if prev_data is not None:
-            self._lexer._saved_state_stack = prev_data.syntax_stack
-        elif hasattr(self._lexer, '_saved_state_stack'):
-            del self._lexer._saved_state_stack
 
-        # Lex the text using Pygments
-        index = 0
-        for token, text in self._lexer.get_tokens(string):
-            length = len(text)
-            self.setFormat(index, length, self._get_format(token))
-            index += length
+class FormatRegistry(object):
+    """ Process-wide table of QTextCharFormats for the token types of a style.
 
-        if hasattr(self._lexer, '_saved_state_stack'):
-            data = PygmentsBlockUserData(
-                syntax_stack=self._lexer._saved_state_stack)
-            self.currentBlock().setUserData(data)
-            # Clean up for the next go-round.
-            del self._lexer._saved_state_stack
+        Use FormatRegistry.for_style or FormatRegistry.for_style_sheet; the
+        table for each style is built once and shared by every highlighter.
+    """
 
-    #---------------------------------------------------------------------------
-    # 'PygmentsHighlighter' interface
-    #---------------------------------------------------------------------------
+    _registries = {}
 
-    def set_style(self, style):
-        """ Sets the style to the specified Pygments style.
+    def __init__(self, style=None, stylesheet=None):
+        self.style = style
+        self.stylesheet = stylesheet
+        self._brushes = {}
+        self.formats = {}
+        if style is not None:
+            for token, _ in style:
+                self.format(token)
+
+        # Changes with the style's definitions (see HighlightCache)
+        if style is not None:
+            source = repr(sorted((str(token), value)
+                                 for token, value in style.styles.items()))
+        else:
+            source = stylesheet
+        self.version = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def for_style(cls, style):
+        """ Returns the shared registry for a Pygments style (or its name).
         """
         if isinstance(style, str):
+            from pygments.styles import get_style_by_name
             style = get_style_by_name(style)
-        self._style = style
-        self._clear_caches()
-
-    def set_style_sheet(self, stylesheet):
-        """ Sets a CSS stylesheet. The classes in the stylesheet should
-        correspond to those generated by:
-
-            pygmentize -S <style> -f html
+        registry = cls._registries.get(style)
+        if registry is None:
+            registry = cls._registries[style] = cls(style=style)
+        return registry
+
+    @classmethod
+    def for_style_sheet(cls, stylesheet):
+        """ Returns the shared registry for a CSS stylesheet.
+        """
+        registry = cls._registries.get(stylesheet)
+        if registry is None:
+            registry = cls._registries[stylesheet] = cls(stylesheet=stylesheet)
+        return registry
 
-        Note that 'set_style' and 'set_style_sheet' completely override each
-        other, i.e. they cannot be used in conjunction.
+    def format(self, token):
+        """ Returns the QTextCharFormat for token.
         """
-        self._document.setDefaultStyleSheet(stylesheet)
-        self._style = None
-        self._clear_caches()
+        result = self.formats.get(token)
+        if result is None:
+            if self.style is None:
+                result = self._get_format_from_document(token)
+            else:
+                result = self._get_format_from_style(token, self.style)
+            result.setProperty(TOKEN_PROPERTY, token_id(token))
+            self.formats[token] = result
+        return result
 
     #---------------------------------------------------------------------------
     # Protected interface
     #---------------------------------------------------------------------------
 
-    def _clear_caches(self):
-        """ Clear caches for brushes and formats.
-        """
-        self._brushes = {}
-        self._formats = {}
-
-    def _get_format(self, token):
-        """ Returns a QTextCharFormat for token or None.
-        """
-        if token in self._formats:
-            return self._formats[token]
-
-        if self._style is None:
-            result = self._get_format_from_document(token, self._document)
-        else:
-            result = self._get_format_from_style(token, self._style)
-
-        self._formats[token] = result
-        return result
-
-    def _get_format_from_document(self, token, document):
-        """ Returns a QTextCharFormat for token by
+    def _get_format_from_document(self, token):
+        """ Returns a QTextCharFormat for token by rendering it as HTML in a
+        scratch document that uses the stylesheet.
         """
+        if not hasattr(self, '_document'):
+            from pygments.formatters.html import HtmlFormatter
+            self._formatter = HtmlFormatter(nowrap=True)
+            self._document = QtGui.QTextDocument()
+            self._document.setDefaultStyleSheet(self.stylesheet)
         code, html = next(self._formatter._format_lines([(token, u'dummy')]))
         self._document.setHtml(html)
-        return QtGui.QTextCursor(self._document).charFormat()
+        return QtGui.QTextCharFormat(
+            QtGui.QTextCursor(self._document).charFormat())
 
     def _get_format_from_style(self, token, style):
         """ Returns a QTextCharFormat for token by reading a Pygments style.
         """
+        # Tokens made up by a lexer take the style of their nearest parent
+        while not style.styles_token(token) and token.parent is not None:
+            token = token.parent
         result = QtGui.QTextCharFormat()
         for key, value in style.style_for_token(token).items():
             if value:
@@ -236,3 +262,677 @@ class PygmentsHighlighter(QtGui.QSyntaxHighlighter):
                       int(color[2:4], base=16),
                       int(color[4:6], base=16))
         return qcolor
+
+
+class TokenCache(object):
+    """ Bounded LRU cache of lexed lines.
+
+        Entries are keyed by (entry block state, line text), where the block
+        state stands for the interned syntax stack, and hold the token runs
+        and exit block state. Memory use is estimated and kept under
+        ``max_bytes``.
+    """
+
+    # Rough cost of an entry and of each (token, length) run in it
+    entry_bytes = 200
+    run_bytes = 64
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """ Drop every entry (the hit/miss counters are kept).
+        """
+        self._entries.clear()
+        self.size = 0
+
+    def get(self, state, text):
+        """ Returns (runs, exit state) or None, counting the hit or miss.
+        """
+        entry = self._entries.get((state, text))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end((state, text))
+        return entry[:2]
+
+    def put(self, state, text, runs, exit_state):
+        """ Stores a lexed line, evicting the least recently used entries.
+        """
+        key = (state, text)
+        cost = self.entry_bytes + 2 * len(text) + self.run_bytes * len(runs)
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[2]
+        self._entries[key] = (runs, exit_state, cost)
+        self.size += cost
+        while self.size > self.max_bytes and self._entries:
+            self.size -= self._entries.popitem(last=False)[1][2]
+
+
+class PygmentsHighlighter(QtGui.QSyntaxHighlighter):
+    """ Syntax highlighter that uses Pygments for parsing. """
+
+    # Connected straight to QSyntaxHighlighter's private re-highlighting slot
+    _reformat = QtCore.Signal(int, int, int)
+
+    #---------------------------------------------------------------------------
+    # 'QSyntaxHighlighter' interface
+    #---------------------------------------------------------------------------
+
+    def __init__(self, parent, lexer=None, cache_size=8 * 1024 * 1024):
+        super(PygmentsHighlighter, self).__init__(parent)
+
+        # A given Pygments lexer, or the shared lexer for the file type
+        # (see set_filename), which the worker process can look up again
+        if lexer:
+            self._lexer = HighlightLexer(lexer)
+            self._filename = None
+        else:
+            self._filename = 'untitled.py'
+            self._lexer = lexer_for_filename(self._filename)
+        self.lexed_blocks = 0
+        self.cache = TokenCache(cache_size)
+        self.disk_cache = HighlightCache()
+        self.set_style(PythonStyle)
+
+        # Lazy highlighting: blocks outside the viewport are left pending and
+        # finished in time-boxed slices on a zero-interval timer
+        self._editor = parent
+        self._lazy = False
+        self._window = (0, 0)
+        self._deadline = 0
+        self._pending = None
+        self._stale = []
+        self._last_block = None
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._highlight_slice)
+        self.slice_time = 0.01
+
+        # Runs lexed by a worker process, by line number, and how many lines
+        # have arrived so far
+        self._job = None
+        self._precomputed = {}
+        self._lexed_until = float('inf')
+
+        # Semantic spans drawn over the lexical formats (see set_overlay)
+        self._overlay = None
+
+        # Lines longer than this are only lexed in a window around the
+        # cursor, by block number (see set_long_line)
+        self.long_line = None
+        self._long_windows = {}
+
+        # Plain mode: blocks are left unformatted (see set_plain)
+        self.plain = False
+
+        # Bulk edits: highlighting is suspended and the changed range of
+        # the document recorded (see suspend)
+        self._suspended = 0
+        self._dirty_range = None
+        QtCore.QObject.connect(self, QtCore.SIGNAL('_reformat(int,int,int)'),
+                               self, _reformat_blocks)
+
+        # Brackets of each block, for matching them; the index follows the
+        # document's blocks, so it must hear of changes before highlighting
+        self.brackets = BracketIndex(parent.document())
+
+        self._restyling = False
+        self.setDocument(parent.document())
+
+    def highlightBlock(self, string):
+        """ Highlight a block of text.
+        """
+        if self._restyling:
+            self._restyle_block()
+            return
+        if self.plain:
+            self.brackets.update(self.currentBlock().blockNumber(), None)
+            self.setCurrentBlockState(0)
+            return
+        if self._lazy and not self._may_lex(self.currentBlock()):
+            self.brackets.update(self.currentBlock().blockNumber(), None)
+            self._defer_block()
+            return
+        if self.long_line is not None and len(string) > self.long_line:
+            self._highlight_long_block(string)
+            return
+
+        self.lexed_blocks += 1
+        self._last_block = self.currentBlock()
+        if self._precomputed:
+            runs, state = self._lex_precomputed(self.previousBlockState(),
+                                                string)
+        else:
+            runs, state = self._lex(self.previousBlockState(), string)
+        self.brackets.update(self._last_block.blockNumber(),
+                             bracket_entry(string, runs))
+
+        index = 0
+        formats = self._formats
+        for token, length in runs:
+            format = formats.get(token)
+            if format is None:
+                format = self._registry.format(token)
+            self.setFormat(index, length, format)
+            index += length
+        if self._overlay is not None:
+            for index, length, token in self._overlay.spans(
+                    self.currentBlock(), string):
+                format = formats.get(token)
+                if format is None:
+                    format = self._registry.format(token)
+                self.setFormat(index, length, format)
+
+        self.setCurrentBlockState(state)
+
+    #---------------------------------------------------------------------------
+    # 'PygmentsHighlighter' interface
+    #---------------------------------------------------------------------------
+
+    def lex_block(self, block, length=None):
+        """ Returns the (token, length) runs and exit state of a block's text,
+        or of its first length characters, lexed from its entry state.
+        """
+        string = block.text()
+        if length is not None:
+            string = string[:length]
+        previous = block.previous()
+        state = previous.userState() if previous.isValid() else 0
+        if self.long_line is not None and len(string) > self.long_line:
+            # Too long to lex; taken as plain text that keeps its state
+            return ((Text, len(string)),), max(state, 0)
+        return self._lex(state, string)
+
+    def lex_in_background(self, text):
+        """ Lexes text in a worker process before it is set on the document.
+
+            Only the blocks on screen are lexed on the GUI thread; the lazy
+            highlighting slices apply the worker's runs as they arrive. The
+            runs are kept in the on-disk highlight cache, so reopening an
+            unchanged file applies them without lexing at all.
+        """
+        if not self._lazy or self._filename is None or self.plain:
+            return
+        if self._job is not None:
+            self._job.cancel()
+        self._precomputed = {}
+        self._lexed_until = 0
+        self._job_lines = text.split('\n')
+
+        key = self.disk_cache.key(
+            text, '%s %s' % (self._lexer.name, self._registry.version))
+        cached = self.disk_cache.load(key)
+        if cached is not None:
+            self._receive_batch((0,) + cached)
+            self._finish_job()
+            return
+        self._job = ProcessJob(
+            lex_lines, (text, self._filename, key), parent=self)
+        self._job.batch.connect(self._receive_batch)
+        self._job.done.connect(self._finish_job)
+        self._job.failed.connect(self._finish_job)
+        self._job.start()
+
+    def memory_report(self):
+        """ Returns the memory used for highlighting state, in bytes, with
+        the share of each block.
+
+            Block states are stored by Qt; the interned stacks are shared by
+            every document, and the token cache and worker runs belong to
+            this highlighter.
+        """
+        blocks = self.document().blockCount()
+        stacks = sum(getsizeof(stack) + sum(map(getsizeof, stack))
+                     for stack in _syntax_stacks)
+        precomputed = sum(getsizeof(entry) + getsizeof(entry[2])
+                          for entry in self._precomputed.values())
+        total = stacks + self.cache.size + precomputed
+        return {
+            'blocks': blocks,
+            'interned_stacks': len(_syntax_stacks),
+            'stack_bytes': stacks,
+            'cache_bytes': self.cache.size,
+            'precomputed_bytes': precomputed,
+            'bytes_per_block': total / blocks,
+        }
+
+    def rehighlight_lines(self, lines):
+        """ Highlights the given lines again if they have been highlighted,
+        e.g. when their overlay spans change. Pending lines are left alone.
+        """
+        document = self.document()
+        deadline, self._deadline = self._deadline, float('inf')
+        try:
+            for line in lines:
+                block = document.findBlockByNumber(line)
+                if block.isValid() and block.userState() >= 0:
+                    self._last_block = block
+                    self.rehighlightBlock(block)
+        finally:
+            self._deadline = deadline
+
+    def resume(self):
+        """ Ends a suspend(); once the last one ends, the blocks changed in
+        the meantime are highlighted again, once.
+
+            Returns whether the document changed while suspended.
+        """
+        self._suspended -= 1
+        if self._suspended:
+            return False
+        self.document().contentsChange.disconnect(self._record_change)
+        dirty, self._dirty_range = self._dirty_range, None
+        if self.plain:
+            return dirty is not None
+        QtCore.QObject.connect(self.document(), _contents_change, self,
+                               _reformat_blocks)
+        if dirty is not None:
+            start, end = dirty
+            end = min(end, self.document().characterCount())
+            if self._lazy:
+                self._defer_range(start, end)
+            else:
+                self._reformat.emit(start, 0, max(end - start, 0))
+        self.update_viewport()
+        return dirty is not None
+
+    def set_filename(self, filename):
+        """ Switches to the lexer for a filename's file type, re-highlighting
+        the document if the lexer changes.
+        """
+        lexer = lexer_for_filename(filename)
+        self._filename = filename
+        if lexer is not self._lexer:
+            self._lexer = lexer
+            if self._job is not None:
+                self._job.cancel()
+                self._finish_job()
+            self._precomputed = {}
+            self.cache.clear()
+            self.rehighlight()
+
+    def set_lazy(self, lazy):
+        """ Turns viewport-first lazy highlighting on or off.
+        """
+        self._lazy = lazy
+        if not lazy and self._job is not None:
+            self._job.cancel()
+            self._finish_job()
+        if lazy:
+            self.update_viewport()
+        elif self._pending is not None or self._stale:
+            # Finish everything that was left pending straight away
+            self._deadline = float('inf')
+            self._highlight_slice()
+
+    def set_long_line(self, length):
+        """ Sets the length above which a line is only lexed in a window of
+        that many characters, or None to lex every line whole.
+
+            The window is kept around the cursor when it is on the line. The
+            rest of the line is left plain. The line keeps the state it was
+            entered with, and its brackets are left out of the index.
+        """
+        if self.long_line is None and length is not None:
+            self._editor.cursorPositionChanged.connect(self._follow_cursor)
+        elif self.long_line is not None and length is None:
+            self._editor.cursorPositionChanged.disconnect(self._follow_cursor)
+        self.long_line = length
+        self.brackets.long_line = length
+        self._long_windows = {}
+
+    def set_overlay(self, overlay):
+        """ Sets an object whose spans(block, text) method returns the
+        (column, length, token) spans to draw over a block's lexical formats.
+        """
+        self._overlay = overlay
+
+    def set_plain(self, plain):
+        """ Turns plain mode on or off. In plain mode the document is left
+        unformatted and its changes are not highlighted at all, so loading
+        and editing it costs no Python per block.
+
+            Turning plain mode on clears the formats and states of every
+            block; turning it off highlights the document again, in lazy
+            mode starting from the viewport. Brackets are read from the text
+            of the blocks while in plain mode.
+        """
+        if plain == self.plain:
+            return
+        self.plain = plain
+        document = self.document()
+        if plain:
+            if self._job is not None:
+                self._job.cancel()
+                self._finish_job()
+            self._precomputed = {}
+            self._pending = None
+            self._stale = []
+            self._long_windows = {}
+            QtCore.QObject.disconnect(document, _contents_change, self,
+                                      _reformat_blocks)
+            block = document.firstBlock()
+            while block.isValid():
+                block.layout().clearFormats()
+                block.setUserState(-1)
+                self.brackets.update(block.blockNumber(), None)
+                block = block.next()
+            length = document.characterCount()
+            document.documentLayout().documentChanged(0, length, length)
+        else:
+            QtCore.QObject.connect(document, _contents_change, self,
+                                   _reformat_blocks)
+            if self._lazy:
+                self._defer_range(0, document.characterCount())
+                self.update_viewport()
+            else:
+                self.rehighlight()
+
+    def set_style(self, style):
+        """ Sets the style to the specified Pygments style.
+
+            Blocks that are already highlighted are restyled from the token
+            types recorded in their formats, without being lexed again.
+        """
+        self._set_registry(FormatRegistry.for_style(style))
+
+    def set_style_sheet(self, stylesheet):
+        """ Sets a CSS stylesheet. The classes in the stylesheet should
+        correspond to those generated by:
+
+            pygmentize -S <style> -f html
+
+        Note that 'set_style' and 'set_style_sheet' completely override each
+        other, i.e. they cannot be used in conjunction.
+        """
+        self._set_registry(FormatRegistry.for_style_sheet(stylesheet))
+
+    def suspend(self):
+        """ Stops highlighting for a bulk edit until resume() is called.
+
+            Qt's own re-highlighting of each change is disconnected and only
+            the range of the document that changed is recorded; resume()
+            re-highlights that range in a single pass, which cascades past
+            its end while block states change. In lazy mode the range is
+            left pending instead, for the viewport and the idle slices.
+            Calls may be nested.
+        """
+        self._suspended += 1
+        if self._suspended == 1:
+            self._dirty_range = None
+            if not self.plain:
+                QtCore.QObject.disconnect(self.document(), _contents_change,
+                                          self, _reformat_blocks)
+            self.document().contentsChange.connect(self._record_change)
+
+    def update_viewport(self):
+        """ Moves the lazy highlighting priority to the visible blocks and
+        highlights any of them that are still pending.
+        """
+        if not self._lazy or self._suspended:
+            return
+        first = self._editor.firstVisibleBlock()
+        height = self._editor.fontMetrics().lineSpacing() or 1
+        count = self._editor.viewport().height() // height + 2
+        self._window = (first.blockNumber(), first.blockNumber() + count)
+
+        # Stale blocks first, as pending visible blocks are lexed after them
+        for block in self._take_stale(self._window):
+            self.rehighlightBlock(block)
+        block = first
+        while block.isValid() and block.blockNumber() <= self._window[1]:
+            if block.userState() == PENDING_STATE:
+                self._last_block = block
+                self.rehighlightBlock(block)
+                block = self._last_block
+            block = block.next()
+
+    #---------------------------------------------------------------------------
+    # Protected interface
+    #---------------------------------------------------------------------------
+
+    def _defer_block(self):
+        """ Leaves the current block to be highlighted later.
+        """
+        if self.currentBlockState() >= 0:
+            # The block was lexed before, so keep its state to stop the
+            # re-highlight cascade here and re-lex it later
+            self._stale.append(self.currentBlock())
+        else:
+            self.setCurrentBlockState(PENDING_STATE)
+            number = self.currentBlock().blockNumber()
+            if self._pending is None or number < self._pending:
+                self._pending = number
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _defer_range(self, start, end):
+        """ Leaves the blocks of a [start, end) range of characters pending,
+        without going through highlightBlock for each of them.
+        """
+        block = self.document().findBlock(start)
+        if not block.isValid():
+            return
+        number = block.blockNumber()
+        block.setUserState(PENDING_STATE)
+        block = block.next()
+        while block.isValid() and block.position() < end:
+            block.setUserState(PENDING_STATE)
+            block = block.next()
+        if self._pending is None or number < self._pending:
+            self._pending = number
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _follow_cursor(self):
+        """ Moves the lexed window of a long line along with the cursor once
+        the cursor gets near its edge.
+        """
+        cursor = self._editor.textCursor()
+        block = cursor.block()
+        length = block.length() - 1
+        if length <= self.long_line:
+            return
+        start = self._long_windows.get(block.blockNumber(), 0)
+        wanted = self._long_window(length, cursor.positionInBlock())
+        if abs(wanted - start) > self.long_line // 4:
+            self.rehighlightBlock(block)
+
+    def _finish_job(self, *args):
+        """ Stops waiting for the worker; anything it did not lex is lexed
+        here.
+        """
+        self._job = None
+        self._job_lines = None
+        self._lexed_until = float('inf')
+        if self._pending is not None and not self._timer.isActive():
+            self._timer.start()
+
+    def _highlight_slice(self):
+        """ Highlights pending blocks until the slice's time runs out.
+        """
+        if self._suspended:
+            return
+        if self._deadline != float('inf'):
+            self._deadline = perf_counter() + self.slice_time
+        document = self.document()
+
+        # Re-lex stale blocks first
+        for block in self._take_stale():
+            if perf_counter() >= self._deadline:
+                self._stale.append(block)
+                continue
+            self.rehighlightBlock(block)
+
+        # Then continue through the pending blocks in document order
+        if self._pending is not None:
+            block = document.findBlockByNumber(self._pending)
+            self._pending = None
+            while block.isValid() and perf_counter() < self._deadline and \
+                    block.blockNumber() < self._lexed_until:
+                if block.userState() == PENDING_STATE:
+                    self._last_block = block
+                    self.rehighlightBlock(block)
+                    block = self._last_block
+                block = block.next()
+            if block.isValid():
+                number = block.blockNumber()
+                if self._pending is None or number < self._pending:
+                    self._pending = number
+
+        # Stop when done, or until the worker sends the next batch
+        self._deadline = 0
+        waiting = self._pending is not None and \
+            self._pending >= self._lexed_until
+        if (self._pending is None or waiting) and not self._stale:
+            self._timer.stop()
+        if self._pending is None and self._job is None:
+            self._precomputed = {}
+
+    def _highlight_long_block(self, string):
+        """ Highlights the window of a long current block (see
+        set_long_line).
+        """
+        block = self.currentBlock()
+        number = block.blockNumber()
+        self.lexed_blocks += 1
+        self._last_block = block
+        self._precomputed.pop(number, None)
+        self.brackets.update(number, bracket_entry(''))
+
+        # The window is lexed from the entry state at the start of the line,
+        # or as new text anywhere else
+        cursor = self._editor.textCursor()
+        column = cursor.positionInBlock() if cursor.block() == block else 0
+        start = self._long_windows[number] = \
+            self._long_window(len(string), column)
+        state = max(self.previousBlockState(), 0)
+        runs, _ = self._lex(state if start == 0 else 0,
+                            string[start:start + self.long_line])
+
+        index = start
+        formats = self._formats
+        for token, length in runs:
+            format = formats.get(token)
+            if format is None:
+                format = self._registry.format(token)
+            self.setFormat(index, length, format)
+            index += length
+        self.setCurrentBlockState(state)
+
+    def _long_window(self, length, column):
+        """ Returns the start of the window of a long line with the cursor at
+        a column.
+        """
+        start = column - self.long_line // 2
+        return max(0, min(start, length - self.long_line))
+
+    def _may_lex(self, block):
+        """ Whether a block may be lexed now in lazy mode.
+        """
+        number = block.blockNumber()
+        if self._window[0] <= number <= self._window[1]:
+            return True
+        return perf_counter() < self._deadline and number < self._lexed_until
+
+    def _receive_batch(self, batch):
+        """ Stores a batch of runs from the worker and schedules applying it.
+        """
+        first, names, lines = batch
+        tokens = [token_for_name(name) for name in names]
+        state = self._precomputed_state if first else 0
+        for number, (runs, stack) in enumerate(lines, first):
+            exit_state = state_for_stack(stack)
+            runs = tuple(zip(map(tokens.__getitem__, runs[::2]), runs[1::2]))
+            self._precomputed[number] = (
+                self._job_lines[number], state, runs, exit_state)
+            state = exit_state
+        self._precomputed_state = state
+        self._lexed_until = first + len(lines)
+        if self._pending is not None and not self._timer.isActive():
+            self._timer.start()
+
+    def _record_change(self, position, removed, added):
+        """ Grows the recorded [start, end) range of changed characters.
+        """
+        self._dirty_range = grow_range(self._dirty_range, position, removed,
+                                       added)
+
+    def _lex_precomputed(self, state, string):
+        """ Like _lex, but uses the worker's runs for the current block if
+        they were lexed from the same text and entry state.
+        """
+        if state < 0:
+            state = 0
+        entry = self._precomputed.pop(self.currentBlock().blockNumber(), None)
+        if entry is not None and entry[0] == string and entry[1] == state:
+            return entry[2:]
+        return self._lex(state, string)
+
+    def _restyle_block(self):
+        """ Maps the current block's formats to the current style.
+        """
+        formats = self._formats
+        block = self.currentBlock()
+        for run in block.layout().formats():
+            index = run.format.property(TOKEN_PROPERTY)
+            if index is not None:
+                token = _tokens_by_id[index]
+                format = formats.get(token)
+                if format is None:
+                    format = self._registry.format(token)
+                self.setFormat(run.start, run.length, format)
+
+    def _set_registry(self, registry):
+        """ Switches to the formats of a registry, restyling the document.
+        """
+        restyle = getattr(self, '_registry', None) not in (None, registry)
+        self._registry = registry
+        self._formats = registry.formats
+        if restyle and self.document() is not None:
+            self._restyling = True
+            try:
+                self.rehighlight()
+            finally:
+                self._restyling = False
+
+    def _take_stale(self, window=None):
+        """ Removes and returns the valid stale blocks, optionally only those
+        inside a (first, last) block number window.
+        """
+        taken, kept = [], []
+        for block in self._stale:
+            if not block.isValid():
+                continue
+            if window and not window[0] <= block.blockNumber() <= window[1]:
+                kept.append(block)
+            else:
+                taken.append(block)
+        self._stale = kept
+        return taken
+
+
+    def _lex(self, state, string):
+        """ Returns the (token, length) runs and exit state for a line lexed
+        from the given entry state, using the token cache where possible.
+        """
+        if state < 0:
+            state = 0
+        cached = self.cache.get(state, string)
+        if cached is not None:
+            return cached
+
+        # Lex the text using Pygments
+        runs, stack = self._lexer.lex(_syntax_stacks[state], string)
+        exit_state = state_for_stack(stack)
+        self.cache.put(state, string, runs, exit_state)
+        return runs, exit_state
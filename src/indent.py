@@ -0,0 +1,192 @@
+#
+#  indent.py
+#
+import re
+from pygments.token import Comment, String
+from src.highlighter import in_string, stack_for_state
+
+# Statements after which IDLE dedents the next line
+_closer = re.compile(r'\s*(return|break|continue|raise|pass)\b')
+
+
+def _indentation(text, tab_width=4):
+    """ Returns the width of the leading whitespace of a line.
+    """
+    text = text.expandtabs(tab_width)
+    return len(text) - len(text.lstrip())
+
+
+class IndentEngine(object):
+    """ Works out the indentation of a new line the way IDLE does.
+
+        Inside brackets, the line lines up with the first item after the
+        innermost open bracket, or is indented a level past the bracket's
+        line if nothing follows it. A backslash continues the statement
+        beyond its leftmost '='. Inside a string the indentation is left
+        alone. Otherwise the line is indented like the start of the
+        statement, a level deeper after a ':' and a level shallower after
+        return, break, continue, raise or pass.
+
+        Only the lines of the current statement are read: the open bracket
+        comes from the highlighter's bracket index and the string state from
+        the block states, so the cost does not grow with the document.
+    """
+
+    indent_width = 4
+
+    def __init__(self, highlighter):
+        self._highlighter = highlighter
+
+    def newline_indent(self, block, column):
+        """ Returns the width of the indentation of the line that splitting
+        a block at a column starts.
+        """
+        text = block.text()[:column]
+        if not text.strip():
+            if in_string(block.previous()):
+                return _indentation(text)
+
+            # Indent as if Enter was pressed after the previous statement
+            block = block.previous()
+            while block.isValid() and not block.text().strip():
+                block = block.previous()
+            if not block.isValid():
+                return 0
+            text = block.text()
+            column = len(text)
+
+        runs, state = self._highlighter.lex_block(block, column)
+        if runs and runs[-1][0] in String and \
+                len(stack_for_state(state)) > 1:
+            # Only mimic the indentation of strings started on earlier lines
+            if in_string(block.previous()):
+                return _indentation(text)
+            return 0
+
+        # The text without any comment and trailing whitespace
+        index = end = 0
+        for token, length in runs:
+            if token not in Comment and text[index:index + length].strip():
+                end = index + length
+            index += length
+        code = text[:end].rstrip()
+
+        brackets = self._highlighter.brackets
+        opener = brackets.enclosing(block.position() + column)
+        if opener is not None:
+            return self._bracket_indent(block, column, opener)
+        if code.endswith('\\'):
+            return self._backslash_indent(block, code)
+
+        start = self._statement_start(block)
+        indent = _indentation(start.text())
+        if code.endswith(':'):
+            indent += self.indent_width
+        elif indent and _closer.match(start.text()):
+            indent = (indent - 1) // self.indent_width * self.indent_width
+        return indent
+
+    #---------------------------------------------------------------------------
+    # Protected interface
+    #---------------------------------------------------------------------------
+
+    def _backslash_indent(self, block, code):
+        """ Returns the indentation after a line ending in a backslash.
+        """
+        # A statement already continued keeps the current indentation
+        previous = block.previous()
+        if previous.isValid() and self._continues(previous):
+            return _indentation(code)
+
+        # Go beyond the leftmost '=' if more follows it, or else beyond the
+        # first word
+        match = re.search(r'(?<![=!<>])=(?!=)', code)
+        if match and code[match.end():].strip() != '\\':
+            column = match.end()
+        else:
+            column = len(code) - len(code.lstrip())
+            while column < len(code) and code[column] not in ' \t':
+                column += 1
+        return len(code[:column].expandtabs(self.indent_width)) + 1
+
+    def _bracket_indent(self, block, column, opener):
+        """ Returns the indentation inside the bracket at position opener.
+        """
+        document = self._highlighter.document()
+        line = document.findBlock(opener)
+        text = line.text()
+        if line == block:
+            text = text[:column]
+        bracket = opener - line.position()
+        after = text[bracket + 1:]
+        if not after.strip() or after.lstrip().startswith('#'):
+            return _indentation(text) + self.indent_width
+        return len(text[:bracket + 1].expandtabs(self.indent_width)) + \
+            len(after) - len(after.lstrip())
+
+    def _continues(self, block):
+        """ Whether a block ends in a backslash outside a string.
+        """
+        return block.text().rstrip().endswith('\\') and \
+            not in_string(block)
+
+    def _statement_start(self, block):
+        """ Returns the first block of the statement a block ends.
+        """
+        brackets = self._highlighter.brackets
+        document = self._highlighter.document()
+        while True:
+            previous = block.previous()
+            opener = brackets.enclosing(block.position())
+            if opener is not None:
+                block = document.findBlock(opener)
+            elif previous.isValid() and (self._continues(previous) or
+                                         in_string(previous)):
+                block = previous
+            else:
+                return block
+
+
+class IndentLevels(object):
+    """ Cache of the indentation width of each line of a document.
+
+        A change only forgets the widths of the lines it touches, and those
+        are measured again when next asked for; scrolling past lines that
+        haven't changed reads the cache alone.
+    """
+
+    def __init__(self, document, tab_width=4):
+        self._document = document
+        self._widths = [None] * document.blockCount()
+        self.tab_width = tab_width
+        document.contentsChange.connect(self._contents_change)
+
+    def width(self, block):
+        """ Returns the indentation width of a block, or -1 if it is blank.
+        """
+        number = block.blockNumber()
+        width = self._widths[number]
+        if width is None:
+            text = block.text()
+            width = _indentation(text, self.tab_width) if text.strip() else -1
+            self._widths[number] = width
+        return width
+
+    #---------------------------------------------------------------------------
+    # Protected interface
+    #---------------------------------------------------------------------------
+
+    def _contents_change(self, position, removed, added):
+        """ Forgets the widths of the changed lines, keeping the others in
+        line with the block numbers.
+        """
+        document = self._document
+        first = document.findBlock(position)
+        last = document.findBlock(position + added)
+        if not last.isValid():
+            last = document.lastBlock()
+        if not first.isValid():
+            first = last
+        first, last = first.blockNumber(), last.blockNumber()
+        delta = document.blockCount() - len(self._widths)
+        self._widths[first:last - delta + 1] = [None] * (last - first + 1)
@@ -0,0 +1,306 @@
+#
+#  lexer.py
+#
+import os
+import re
+from fnmatch import fnmatch
+from importlib import import_module
+from pygments.lexer import ExtendedRegexLexer, RegexLexer, words, _TokenType
+from pygments.token import Token, Text, Error
+
+# A leading global inline flag group, e.g. '(?i)'
+_global_flags = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+# Numbered or named backreferences, which cannot be joined with other rules
+_backreference = re.compile(r'\\[1-9]|\(\?P=')
+
+# Pygments lexers by file extension, as (module, class name); the module is
+# only imported the first time a file of its language is opened
+LEXERS = {
+    '.py': ('pygments.lexers.python', 'PythonLexer'),
+    '.pyw': ('pygments.lexers.python', 'PythonLexer'),
+    '.pyi': ('pygments.lexers.python', 'PythonLexer'),
+    '.py3': ('pygments.lexers.python', 'PythonLexer'),
+    '.json': ('pygments.lexers.data', 'JsonLexer'),
+    '.yml': ('pygments.lexers.data', 'YamlLexer'),
+    '.yaml': ('pygments.lexers.data', 'YamlLexer'),
+    '.md': ('pygments.lexers.markup', 'MarkdownLexer'),
+    '.rst': ('pygments.lexers.markup', 'RstLexer'),
+    '.cfg': ('pygments.lexers.configs', 'IniLexer'),
+    '.ini': ('pygments.lexers.configs', 'IniLexer'),
+    '.toml': ('pygments.lexers.configs', 'TOMLLexer'),
+    '.html': ('pygments.lexers.html', 'HtmlLexer'),
+    '.htm': ('pygments.lexers.html', 'HtmlLexer'),
+    '.xml': ('pygments.lexers.html', 'XmlLexer'),
+    '.css': ('pygments.lexers.css', 'CssLexer'),
+    '.qss': ('pygments.lexers.css', 'CssLexer'),
+    '.js': ('pygments.lexers.javascript', 'JavascriptLexer'),
+    '.sh': ('pygments.lexers.shell', 'BashLexer'),
+    '.txt': ('pygments.lexers.special', 'TextLexer'),
+}
+_lexers = {}
+
+
+def lexer_for_filename(filename):
+    """ Returns the line lexer for a filename, shared by every highlighter.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    key = LEXERS.get(extension) or _find_lexer(filename)
+    lexer = _lexers.get(key)
+    if lexer is None:
+        module, name = key
+        pygments_lexer = getattr(import_module(module), name)()
+        if isinstance(pygments_lexer, RegexLexer) and \
+                not isinstance(pygments_lexer, ExtendedRegexLexer):
+            lexer = HighlightLexer(pygments_lexer)
+        else:
+            lexer = LineLexer(pygments_lexer)
+        lexer.language = key
+        _lexers[key] = lexer
+    return lexer
+
+
+def _find_lexer(filename):
+    """ Returns the (module, class name) of the Pygments lexer for a file
+    type missing from LEXERS, without importing any lexers.
+    """
+    from pygments.lexers._mapping import LEXERS as PYGMENTS_LEXERS
+    basename = os.path.basename(filename)
+    for name, (module, _, _, patterns, _) in PYGMENTS_LEXERS.items():
+        if any(fnmatch(basename, pattern) for pattern in patterns):
+            return module, name
+    return LEXERS['.txt']
+
+
+def _runs(tokens):
+    """ Merges (tokentype, text) pairs into (tokentype, length) runs.
+    """
+    runs = []
+    token = None
+    length = 0
+    for next_token, value in tokens:
+        if next_token is token:
+            length += len(value)
+        else:
+            if length:
+                runs.append((token, length))
+            token = next_token
+            length = len(value)
+    if length:
+        runs.append((token, length))
+    return tuple(runs)
+
+
+class HighlightLexer(object):
+    """ Line lexer for the highlighter, built from a Pygments RegexLexer.
+
+        The lexer's state table is flattened once, with the rules of each
+        state joined into a single regular expression so that finding the
+        next token is one match instead of one per rule. Keywords and
+        builtins are looked up in precomputed tables and adjacent tokens of
+        the same type are merged into a single run.
+    """
+
+    def __init__(self, lexer):
+        self.lexer = lexer
+        self.name = lexer.name
+
+        # Words re-tokenized as keywords and builtins, whatever the rule
+        # that matched them
+        self.keywords = self._words('keywords')
+        if 'Python' in self.name:
+            self.keywords |= frozenset(('from',))
+        self.builtins = self._words('builtins') - self.keywords
+        self._retoken = dict.fromkeys(self.builtins, Token.Name.Builtin)
+        self._retoken.update(dict.fromkeys(self.keywords, Token.Keyword))
+
+        # Each state becomes (joined match or None, rules, rule by group)
+        # where each rule is (match, token or None, callback or None, states
+        # to push or None, '#pop'/'#push' transition or None)
+        self._states = dict((name, self._flatten_state(rules))
+                            for name, rules in lexer._tokens.items())
+
+    def __getattr__(self, name):
+        # Callbacks are given this lexer in place of the Pygments lexer, and
+        # may read its options and settings (e.g. using(), handlecodeblocks)
+        lexer = self.__dict__.get('lexer')
+        if lexer is None:
+            raise AttributeError(name)
+        return getattr(lexer, name)
+
+    def get_tokens_unprocessed(self, text, stack=('root',)):
+        """ Split ``text`` into (index, tokentype, text) triples, as for a
+        Pygments lexer (rules with callbacks can lex text recursively).
+        """
+        index = 0
+        for token, value in self._tokens(text, list(stack)):
+            yield index, token, value
+            index += len(value)
+
+    def lex(self, stack, string):
+        """ Lexes one line starting from a syntax stack.
+
+            Returns the (token, length) runs and the exit syntax stack.
+        """
+        stack = list(stack)
+        runs = _runs(self._tokens(string + '\n', stack))
+        return runs, tuple(stack)
+
+    #---------------------------------------------------------------------------
+    # Protected interface
+    #---------------------------------------------------------------------------
+
+    def _flatten_state(self, rules):
+        """ Returns a state of the flattened state table.
+        """
+        rules = tuple(self._flatten_rule(*rule) for rule in rules)
+
+        # Join the rules into one alternation; Python's re tries the
+        # alternatives in order, so the first rule that matches still wins
+        patterns = []
+        by_group = [None]
+        for index, rule in enumerate(rules):
+            regex = rule[0].__self__
+            pattern = _global_flags.sub('', regex.pattern)
+            if _backreference.search(pattern):
+                return None, rules, None
+            flags = ''.join(flag for flag, value in (
+                ('i', re.I), ('m', re.M), ('s', re.S), ('x', re.X))
+                if regex.flags & value)
+            if flags:
+                pattern = '(?%s:%s)' % (flags, pattern)
+            patterns.append('(%s)' % pattern)
+            by_group += [index] + [None] * regex.groups
+        try:
+            joined = re.compile('|'.join(patterns))
+        except re.error:
+            return None, rules, None
+        return joined.match, rules, by_group
+
+    def _flatten_rule(self, match, action, new_state):
+        """ Returns a rule of the flattened state table.
+        """
+        token = action if type(action) is _TokenType else None
+        callback = action if token is None and action else None
+        push = transition = None
+        if isinstance(new_state, tuple):
+            if any(state in ('#pop', '#push') for state in new_state):
+                transition = new_state
+            else:
+                push = new_state
+        elif new_state is not None:
+            transition = new_state
+        return match, token, callback, push, transition
+
+    def _tokens(self, text, stack):
+        """ Yields (tokentype, text) pairs, updating stack in place.
+        """
+        pos = 0
+        states = self._states
+        retoken = self._retoken
+        joined, rules, by_group = states[stack[-1]]
+        while 1:
+            if joined is not None:
+                m = joined(text, pos)
+                if m:
+                    rule = rules[by_group[m.lastindex]]
+                    match, token, callback, push, transition = rule
+                    if token is not None:
+                        value = m.group(m.lastindex)
+                        yield retoken.get(value, token), value
+                        pos = m.end()
+                    else:
+                        # Match the rule on its own for the callback's groups
+                        m = match(text, pos)
+                        if callback is not None:
+                            for item in callback(self, m):
+                                yield item[1:]
+                        pos = m.end()
+                    if push is not None:
+                        stack.extend(push)
+                        joined, rules, by_group = states[stack[-1]]
+                    elif transition is not None:
+                        self._transition(stack, transition)
+                        joined, rules, by_group = states[stack[-1]]
+                    continue
+            else:
+                m = None
+                for match, token, callback, push, transition in rules:
+                    m = match(text, pos)
+                    if m:
+                        if token is not None:
+                            value = m.group()
+                            yield retoken.get(value, token), value
+                        elif callback is not None:
+                            for item in callback(self, m):
+                                yield item[1:]
+                        pos = m.end()
+                        if push is not None:
+                            stack.extend(push)
+                            joined, rules, by_group = states[stack[-1]]
+                        elif transition is not None:
+                            self._transition(stack, transition)
+                            joined, rules, by_group = states[stack[-1]]
+                        break
+                if m:
+                    continue
+            try:
+                if text[pos] == '\n':
+                    # at EOL, reset state to "root"
+                    pos += 1
+                    stack[:] = ['root']
+                    joined, rules, by_group = states['root']
+                    yield Text, '\n'
+                    continue
+                yield Error, text[pos]
+                pos += 1
+            except IndexError:
+                break
+
+    def _transition(self, stack, transition):
+        """ Applies a '#pop'/'#push' style state transition to stack.
+        """
+        if isinstance(transition, int):
+            # pop, but never the root state
+            del stack[max(transition, 1 - len(stack)):]
+        elif transition == '#push':
+            stack.append(stack[-1])
+        else:
+            for state in transition:
+                if state == '#pop':
+                    if len(stack) > 1:
+                        stack.pop()
+                elif state == '#push':
+                    stack.append(stack[-1])
+                else:
+                    stack.append(state)
+
+    def _words(self, state):
+        """ Returns the words matched by the first rule of a state, if any.
+        """
+        rules = self.lexer.tokens.get(state)
+        if rules and isinstance(rules[0], tuple) and \
+                isinstance(rules[0][0], words):
+            return frozenset(rules[0][0].words)
+        return frozenset()
+
+
+class LineLexer(object):
+    """ Line lexer for Pygments lexers that are not plain RegexLexers (their
+    callbacks or tokenizers cannot be resumed from a syntax stack).
+
+        Each line is lexed on its own, so tokens spanning several lines are
+        not followed and the exit stack is always the root.
+    """
+
+    def __init__(self, lexer):
+        self.lexer = lexer
+        self.name = lexer.name
+
+    def lex(self, stack, string):
+        """ Lexes one line, ignoring the syntax stack.
+
+            Returns the (token, length) runs and the root syntax stack.
+        """
+        tokens = self.lexer.get_tokens_unprocessed(string + '\n')
+        return _runs(item[1:] for item in tokens), ('root',)
@@ -0,0 +1,63 @@
+#
+#  policy.py
+#
+from collections import namedtuple
+
+# Size of a document: its UTF-8 bytes, blocks and longest line in characters
+Metrics = namedtuple('Metrics', 'size blocks longest')
+
+# Feature modes, from the most features to the fewest
+FULL, REDUCED, PLAIN = 'full', 'reduced', 'plain'
+MODES = (FULL, REDUCED, PLAIN)
+
+# The features each mode keeps on
+FEATURES = {
+    FULL: {
+        'highlighting': True, 'semantic': True, 'occurrences': True,
+        'braces': True, 'currentLine': True, 'completion': True,
+        'lazyGutter': False,
+    },
+    REDUCED: {
+        'highlighting': True, 'semantic': False, 'occurrences': False,
+        'braces': True, 'currentLine': True, 'completion': False,
+        'lazyGutter': True,
+    },
+    PLAIN: {
+        'highlighting': False, 'semantic': False, 'occurrences': False,
+        'braces': False, 'currentLine': False, 'completion': False,
+        'lazyGutter': True,
+    },
+}
+
+
+def measure(text):
+    """ Returns the Metrics of a text.
+    """
+    lines = text.split('\n')
+    return Metrics(len(text.encode('utf-8')), len(lines),
+                   max(map(len, lines)))
+
+
+class FeaturePolicy(object):
+    """ Picks the feature mode a document can afford from its Metrics.
+
+        Each mode but FULL has thresholds of size, blocks and longest line;
+        a document goes to the cheapest mode that any of its metrics reach.
+    """
+
+    def __init__(self, thresholds=None):
+        if thresholds is None:
+            thresholds = {
+                REDUCED: Metrics(2 << 20, 50000, 100000),
+                PLAIN: Metrics(32 << 20, 500000, 2000000),
+            }
+        self.thresholds = thresholds
+
+    def mode(self, metrics):
+        """ Returns the mode for a document of the given metrics.
+        """
+        for mode in reversed(MODES[1:]):
+            if any(value >= limit for value, limit in
+                   zip(metrics, self.thresholds[mode])):
+                return mode
+        return FULL
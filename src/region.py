@@ -0,0 +1,66 @@
+#
+#  region.py
+#
+# Line transforms for the Format menu; Editor.transform_region applies one
+# to every line of a region in a single edit
+
+
+def _classify(line, tab_width):
+    """ Returns the length of a line's leading whitespace and its width.
+    """
+    raw = len(line) - len(line.lstrip(' \t'))
+    return raw, len(line[:raw].expandtabs(tab_width))
+
+
+def comment(line):
+    """ Comments a line out the way IDLE does.
+    """
+    return '##' + line
+
+
+def dedent(line, width=4, tab_width=4):
+    """ Removes a level of indentation (at most width columns).
+    """
+    raw, effective = _classify(line, tab_width)
+    return ' ' * max(effective - width, 0) + line[raw:]
+
+
+def indent(line, width=4):
+    """ Adds a level of indentation; empty lines are left empty.
+    """
+    if not line:
+        return line
+    return ' ' * width + line
+
+
+def strip(line):
+    """ Removes trailing whitespace.
+    """
+    return line.rstrip()
+
+
+def tabify(line, tab_width=4):
+    """ Turns the leading whitespace into tabs, then spaces for the rest;
+    empty lines are left empty.
+    """
+    if not line:
+        return line
+    raw, effective = _classify(line, tab_width)
+    tabs, spaces = divmod(effective, tab_width)
+    return '\t' * tabs + ' ' * spaces + line[raw:]
+
+
+def uncomment(line):
+    """ Removes the '##' (or '#') that starts a line.
+    """
+    if line[:2] == '##':
+        return line[2:]
+    if line[:1] == '#':
+        return line[1:]
+    return line
+
+
+def untabify(line, tab_width=4):
+    """ Expands the tabs of a line into spaces.
+    """
+    return line.expandtabs(tab_width)
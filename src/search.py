@@ -0,0 +1,486 @@
+#
+#  search.py
+#
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from PySide2 import QtCore, QtGui
+from src.highlighter import grow_range
+from src.worker import ProcessJob
+
+
+@lru_cache(maxsize=64)
+def compile_pattern(pattern, flags):
+    """ Returns a compiled regular expression, cached by (pattern, flags).
+    """
+    return re.compile(pattern, flags)
+
+
+def count_occurrences(emit, text, needle):
+    """ Counts the occurrences of needle in text in a worker process.
+    """
+    emit(text.count(needle))
+
+
+def find_pattern(text, case_sensitive=False, whole_word=False, regex=False):
+    """ Returns the compiled pattern that finds text, literally unless it
+    is a regular expression; raises re.error for a bad expression.
+    """
+    pattern = text if regex else re.escape(text)
+    if whole_word:
+        pattern = r'(?<!\w)(?:%s)(?!\w)' % pattern
+    flags = re.M if regex else 0
+    if not case_sensitive:
+        flags |= re.I
+    return compile_pattern(pattern, flags)
+
+
+def map_spans(spans, changes):
+    """ Maps (start, end, ...) spans of a document through the
+    (position, removed, added) changes made to it since, dropping the
+    spans that a change touched.
+    """
+    mapped = []
+    for span in spans:
+        start, end = span[0], span[1]
+        for position, removed, added in changes:
+            if end <= position:
+                continue
+            if start < position + removed:
+                break
+            start += added - removed
+            end += added - removed
+        else:
+            mapped.append((start, end) + tuple(span[2:]))
+    return mapped
+
+
+def regex_matches(emit, text, pattern, flags, template=None, batch_size=2000):
+    """ Finds the non-empty matches of a regular expression in a worker
+    process (see RegexJob).
+
+        Emits lists of (start, end) document positions, with the expanded
+        template as a third item when one is given.
+    """
+    compiled = compile_pattern(pattern, flags)
+    astral = [i for i, char in enumerate(text) if char > '\uffff'] \
+        if len(text.encode('utf-16-le')) != 2 * len(text) else None
+    batch = []
+    for match in compiled.finditer(text):
+        start, end = match.span()
+        if start == end:
+            continue
+        if astral:
+            start += bisect_left(astral, start)
+            end += bisect_left(astral, end)
+        batch.append((start, end) if template is None else
+                     (start, end, match.expand(template)))
+        if len(batch) == batch_size:
+            emit(batch)
+            batch = []
+    if batch:
+        emit(batch)
+
+
+def utf16_spans(text, spans, offset=0):
+    """ Converts (start, end) spans of text to document positions, which
+    count UTF-16 code units, adding an offset.
+    """
+    if len(text.encode('utf-16-le')) == 2 * len(text):
+        return [(start + offset, end + offset) for start, end in spans]
+    astral = [i for i, char in enumerate(text) if char > '\uffff']
+    return [(start + bisect_left(astral, start) + offset,
+             end + bisect_left(astral, end) + offset) for start, end in spans]
+
+
+class OccurrenceCounter(QtCore.QObject):
+    """ Counts the occurrences of a selection in a document after a pause,
+    in a worker process for big documents.
+
+        ``settled`` is emitted with the text once the selection stays put
+        for the pause, and ``counted`` with the text and its count. Counting
+        something else, or cancelling, drops the count in progress. The
+        selection is given by its positions and only read when the pause is
+        over, so following a growing selection costs nothing per move.
+    """
+
+    settled = QtCore.Signal(str)
+    counted = QtCore.Signal(str, int)
+
+    # Pause before counting (ms), and the size of the documents (in
+    # characters) that are counted in a worker process
+    delay = 250
+    worker_size = 1 << 20
+
+    def __init__(self, document, parent=None):
+        super(OccurrenceCounter, self).__init__(parent)
+        self._document = document
+        self._span = None
+        self._needle = None
+        self._job = None
+
+        self._pause = QtCore.QTimer(self)
+        self._pause.setSingleShot(True)
+        self._pause.setInterval(self.delay)
+        self._pause.timeout.connect(self._start)
+
+    def cancel(self):
+        """ Drops the pending or running count.
+        """
+        self._pause.stop()
+        self._span = None
+        self._needle = None
+        if self._job is not None:
+            self._job.cancel()
+            self._job.deleteLater()
+            self._job = None
+
+    def count(self, start, end):
+        """ Counts the occurrences of the text between two document
+        positions once the pause is over.
+        """
+        if (start, end) == self._span:
+            return
+        self.cancel()
+        self._span = (start, end)
+        self._pause.start()
+
+    def _receive(self, count):
+        needle = self._needle
+        self.cancel()
+        self.counted.emit(needle, count)
+
+    def _start(self):
+        start, end = self._span
+        if end >= self._document.characterCount():
+            self.cancel()
+            return
+        cursor = QtGui.QTextCursor(self._document)
+        cursor.setPosition(start)
+        cursor.setPosition(end, cursor.KeepAnchor)
+        needle = self._needle = \
+            cursor.selectedText().replace(u'\u2029', '\n')
+        self.settled.emit(needle)
+        if self._document.characterCount() < self.worker_size:
+            self._needle = None
+            self.counted.emit(needle, self._document.toPlainText().count(
+                needle))
+            return
+        self._job = ProcessJob(count_occurrences,
+                               (self._document.toPlainText(), needle),
+                               parent=self)
+        self._job.batch.connect(self._receive)
+        self._job.failed.connect(self.cancel)
+        self._job.start()
+
+
+class RegexJob(QtCore.QObject):
+    """ Finds the matches of a regular expression in a snapshot of a
+    document, in a worker process, so a runaway pattern cannot hang the
+    editor.
+
+        Batches are mapped onto the document as it is when they arrive;
+        matches that later edits touched are dropped. With collect, all the
+        matches are mapped and emitted as one batch when the worker is done.
+        The job fails after timeout ms.
+    """
+
+    batch = QtCore.Signal(object)
+    done = QtCore.Signal()
+    failed = QtCore.Signal(str)
+
+    timeout = 5000
+
+    def __init__(self, document, pattern, template=None, collect=False,
+                 parent=None):
+        super(RegexJob, self).__init__(parent)
+        self._document = document
+        self._changes = []
+        self._collected = [] if collect else None
+        self._job = ProcessJob(
+            regex_matches, (document.toPlainText(), pattern.pattern,
+                            pattern.flags, template),
+            timeout=self.timeout, parent=self)
+        self._job.batch.connect(self._receive)
+        self._job.done.connect(self._finish)
+        self._job.failed.connect(self._fail)
+        document.contentsChange.connect(self._contents_change)
+
+    def cancel(self):
+        """ Stops the worker; no more signals are emitted.
+        """
+        self._job.cancel()
+        try:
+            self._document.contentsChange.disconnect(self._contents_change)
+        except RuntimeError:
+            pass
+
+    def isRunning(self):
+        return self._job.isRunning()
+
+    def start(self):
+        self._job.start()
+
+    def _contents_change(self, position, removed, added):
+        self._changes.append((position, removed, added))
+
+    def _fail(self, message):
+        self.cancel()
+        self.failed.emit(message)
+
+    def _finish(self):
+        self.cancel()
+        if self._collected is not None:
+            self._collected, collected = None, self._collected
+            self._receive(collected)
+        self.done.emit()
+
+    def _receive(self, batch):
+        if self._collected is not None:
+            self._collected.extend(batch)
+            return
+        if self._changes:
+            batch = map_spans(batch, self._changes)
+        self.batch.emit(batch)
+
+
+class SearchIndex(QtCore.QObject):
+    """ Sorted positions of the matches of a query in a document.
+
+        The index is built once per query and then kept up to date as the
+        document changes: changes are gathered into one range and, once
+        control returns to the event loop (or when the index is next read),
+        only the matches around that range are found again.
+
+        Regular expressions are only run in a worker process (see RegexJob),
+        while searching is true. Matches stream into an empty index; after
+        a change, those touching it are dropped and, after a pause, the
+        whole document is searched again and the results swapped in.
+    """
+
+    changed = QtCore.Signal()
+    finished = QtCore.Signal()
+    failed = QtCore.Signal(str)
+
+    # Pause after a change before searching for a regex again (ms)
+    delay = 300
+
+    def __init__(self, document, parent=None):
+        super(SearchIndex, self).__init__(parent)
+        self._document = document
+        self._pattern = None
+        self._regex = False
+        self._length = 0
+        self._starts = []
+        self._ends = []
+        self._dirty = None
+        self._job = None
+        self._incoming = None
+        self.searching = False
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._sync)
+
+        self._pause = QtCore.QTimer(self)
+        self._pause.setSingleShot(True)
+        self._pause.setInterval(self.delay)
+        self._pause.timeout.connect(self._search_in_background)
+
+        document.contentsChange.connect(self._contents_change)
+
+    def __len__(self):
+        self._sync()
+        return len(self._starts)
+
+    @property
+    def pattern(self):
+        """ The compiled pattern of the current query, or None.
+        """
+        return self._pattern
+
+    def clear(self):
+        """ Drops the query and its matches.
+        """
+        self._cancel_job()
+        if self._pattern is not None:
+            self._pattern = None
+            self._starts, self._ends = [], []
+            self._dirty = None
+            self.changed.emit()
+
+    def index(self, start):
+        """ Returns the index of the match at a position, or None.
+        """
+        self._sync()
+        i = bisect_left(self._starts, start)
+        if i < len(self._starts) and self._starts[i] == start:
+            return i
+        return None
+
+    def next(self, position):
+        """ Returns the (start, end) of the first match at or after a
+        position, wrapping around to the first one, or None.
+        """
+        self._sync()
+        if not self._starts:
+            return None
+        i = bisect_left(self._starts, position) % len(self._starts)
+        return self._starts[i], self._ends[i]
+
+    def previous(self, position):
+        """ Returns the (start, end) of the last match before a position,
+        wrapping around to the last one, or None.
+        """
+        self._sync()
+        if not self._starts:
+            return None
+        i = bisect_left(self._starts, position) - 1
+        return self._starts[i], self._ends[i]
+
+    def set_query(self, text, case_sensitive=False, whole_word=False,
+                  regex=False):
+        """ Searches for text, indexing its matches unless it is the current
+        query already; raises re.error for a bad regular expression.
+        """
+        pattern = find_pattern(text, case_sensitive, whole_word, regex) \
+            if text else None
+        if pattern == self._pattern and regex == self._regex:
+            return
+        self._cancel_job()
+        self._pattern = pattern
+        self._regex = regex
+        self._dirty = None
+        self._starts, self._ends = [], []
+        if pattern is not None:
+            if regex:
+                self._search_in_background()
+            else:
+                self._length = len(text.encode('utf-16-le')) // 2
+                text = self._document.toPlainText()
+                spans = utf16_spans(text, [match.span() for match in
+                                           pattern.finditer(text)])
+                self._starts = [start for start, _ in spans]
+                self._ends = [end for _, end in spans]
+        self.changed.emit()
+
+    def spans(self, start, end):
+        """ Returns the (start, end) of the matches that start in a range.
+        """
+        self._sync()
+        low = bisect_left(self._starts, start)
+        high = bisect_right(self._starts, end)
+        return list(zip(self._starts[low:high], self._ends[low:high]))
+
+    #---------------------------------------------------------------------------
+    # Protected interface
+    #---------------------------------------------------------------------------
+
+    def _cancel_job(self):
+        self._pause.stop()
+        if self._job is not None:
+            self._job.cancel()
+            self._job.deleteLater()
+            self._job = None
+        self._incoming = None
+        self.searching = False
+
+    def _contents_change(self, position, removed, added):
+        """ Grows the changed [start, end) range, tracking how much the text
+        after it moved.
+        """
+        if self._pattern is None:
+            return
+        if self._regex:
+            # Results that are to be swapped in are out of date already
+            if self._incoming is not None:
+                self._cancel_job()
+            self._pause.start()
+        if self._dirty is None:
+            changed, delta = None, 0
+        else:
+            changed, delta = self._dirty[:2], self._dirty[2]
+        self._dirty = grow_range(changed, position, removed, added) + \
+            (delta + added - removed,)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _sync(self):
+        """ Finds the matches around the changed range again, and moves the
+        ones after it.
+        """
+        if self._dirty is None:
+            return
+        (start, end, delta), self._dirty = self._dirty, None
+        self._timer.stop()
+        if self._regex:
+            # Drop the matches touching the range; ends are sorted too, as
+            # matches do not overlap
+            low = bisect_right(self._ends, start)
+            high = bisect_left(self._starts, end - delta)
+            self._starts[low:] = [position + delta
+                                  for position in self._starts[high:]]
+            self._ends[low:] = [position + delta
+                                for position in self._ends[high:]]
+            self.changed.emit()
+            return
+
+        # Matches touching the range may have changed, as may whole-word ones
+        # next to it (hence the extra character on each side)
+        length = self._length
+        low = bisect_left(self._starts, start - length)
+        high = bisect_left(self._starts, end - delta + 1)
+
+        first = max(start - length - 1, 0)
+        last = min(end + length + 1, self._document.characterCount() - 1)
+        cursor = QtGui.QTextCursor(self._document)
+        cursor.setPosition(first)
+        cursor.setPosition(max(last, first), cursor.KeepAnchor)
+        text = cursor.selectedText().replace(u'\u2029', '\n')
+        spans = [span for span in utf16_spans(
+            text, [match.span() for match in self._pattern.finditer(text)],
+            first) if start - length <= span[0] < end + 1]
+
+        tail = slice(high, None)
+        self._starts[low:] = [span[0] for span in spans] + \
+            [position + delta for position in self._starts[tail]]
+        self._ends[low:] = [span[1] for span in spans] + \
+            [position + delta for position in self._ends[tail]]
+        self.changed.emit()
+
+    def _fail_job(self, message):
+        self._cancel_job()
+        self.failed.emit(message)
+
+    def _finish_job(self):
+        if self._incoming is not None:
+            self._starts = [span[0] for span in self._incoming]
+            self._ends = [span[1] for span in self._incoming]
+            self._dirty = None
+            self.changed.emit()
+        self._cancel_job()
+        self.finished.emit()
+
+    def _receive(self, batch):
+        """ Adds a batch of regex matches, already mapped onto the document.
+        """
+        if self._incoming is not None:
+            self._incoming.extend(batch)
+            return
+        self._sync()
+        self._starts.extend(span[0] for span in batch)
+        self._ends.extend(span[1] for span in batch)
+        self.changed.emit()
+
+    def _search_in_background(self):
+        """ Searches the whole document for the regex in a worker process.
+        """
+        self._cancel_job()
+        self._incoming = [] if self._starts else None
+        self._job = RegexJob(self._document, self._pattern, parent=self)
+        self._job.batch.connect(self._receive)
+        self._job.done.connect(self._finish_job)
+        self._job.failed.connect(self._fail_job)
+        self.searching = True
+        self._job.start()
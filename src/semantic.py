@@ -0,0 +1,324 @@
+#
+#  semantic.py
+#
+import ast
+import builtins
+import symtable
+from time import perf_counter
+from PySide2 import QtCore
+from src.styles import Semantic
+from src.worker import ProcessJob
+
+BUILTINS = frozenset(dir(builtins))
+
+# Token types of the kinds of names found by the analysis
+SEMANTIC_TOKENS = {
+    'parameter': Semantic.Parameter,
+    'local': Semantic.Local,
+    'global': Semantic.Global,
+    'self_attribute': Semantic.SelfAttribute,
+    'unresolved': Semantic.Unresolved,
+    'shadowed_builtin': Semantic.ShadowedBuiltin,
+}
+
+
+class _Analyser(ast.NodeVisitor):
+    """ Finds the semantic spans of a module from its AST and symbol table.
+    """
+
+    def __init__(self, lines, table):
+        self.lines = lines
+        self.spans = {}
+        self.tables = [table]
+        self.module = table
+
+        # Names bound at module level
+        self.globals = frozenset(
+            symbol.get_name() for symbol in table.get_symbols()
+            if symbol.is_assigned() or symbol.is_imported())
+
+    def add(self, lineno, col, length, kind):
+        """ Records a span, converting the column from bytes to characters.
+        """
+        line = self.lines[lineno - 1]
+        if not line.isascii():
+            col = len(line.encode('utf-8')[:col].decode('utf-8', 'ignore'))
+        self.spans.setdefault(lineno - 1, []).append((col, length, kind))
+
+    def kind(self, name):
+        """ Returns the kind of a name in the current scope, or None.
+        """
+        table = self.tables[-1]
+        try:
+            symbol = table.lookup(name)
+        except KeyError:
+            symbol = None
+
+        if symbol is not None and table is not self.module:
+            if symbol.is_parameter():
+                kind = 'parameter'
+            elif symbol.is_local() or symbol.is_free():
+                kind = 'local'
+            else:
+                kind = None
+            if kind is not None:
+                return 'shadowed_builtin' if name in BUILTINS else kind
+
+        # Module level, or a global/unbound name in a function
+        if name in self.globals:
+            return 'shadowed_builtin' if name in BUILTINS else 'global'
+        if name in BUILTINS:
+            return None
+        return 'unresolved'
+
+    def visit_scope(self, node):
+        """ Visits a node that opens a scope with its symbol table.
+        """
+        table = self.tables[-1]
+        name = getattr(node, 'name', None)
+        if name is None:
+            name = {ast.Lambda: 'lambda', ast.ListComp: 'listcomp',
+                    ast.SetComp: 'setcomp', ast.DictComp: 'dictcomp',
+                    ast.GeneratorExp: 'genexpr'}[type(node)]
+        child = None
+        for candidate in table.get_children():
+            if candidate.get_name() == name and \
+                    candidate.get_lineno() == node.lineno:
+                child = candidate
+                break
+
+        # Decorators, defaults, bases and so on belong to the outer scope
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                             ast.ClassDef)):
+            for decorator in node.decorator_list:
+                self.visit(decorator)
+            if isinstance(node, ast.ClassDef):
+                for base in node.bases + node.keywords:
+                    self.visit(base)
+            else:
+                self.visit_defaults(node.args)
+                if node.returns is not None:
+                    self.visit(node.returns)
+        elif isinstance(node, ast.Lambda):
+            self.visit_defaults(node.args)
+        else:
+            # The first iterable of a comprehension is evaluated outside it
+            self.visit(node.generators[0].iter)
+
+        # Comprehensions (inlined in the symbol table since Python 3.12)
+        # keep using the enclosing table if they have none of their own
+        self.tables.append(child or table)
+        try:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                 ast.Lambda)):
+                for arg in self.iter_args(node.args):
+                    kind = self.kind(arg.arg)
+                    if kind is not None:
+                        self.add(arg.lineno, arg.col_offset, len(arg.arg),
+                                 kind)
+                body = node.body if isinstance(node.body, list) \
+                    else [node.body]
+                for statement in body:
+                    self.visit(statement)
+            elif isinstance(node, ast.ClassDef):
+                for statement in node.body:
+                    self.visit(statement)
+            else:
+                for field in ('elt', 'key', 'value'):
+                    if hasattr(node, field):
+                        self.visit(getattr(node, field))
+                for index, generator in enumerate(node.generators):
+                    self.visit(generator.target)
+                    if index:
+                        self.visit(generator.iter)
+                    for condition in generator.ifs:
+                        self.visit(condition)
+        finally:
+            self.tables.pop()
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = \
+        visit_Lambda = visit_ListComp = visit_SetComp = visit_DictComp = \
+        visit_GeneratorExp = visit_scope
+
+    def visit_defaults(self, args):
+        for default in args.defaults + [d for d in args.kw_defaults if d]:
+            self.visit(default)
+        for arg in self.iter_args(args):
+            if arg.annotation is not None:
+                self.visit(arg.annotation)
+
+    def iter_args(self, args):
+        for arg in args.posonlyargs + args.args + args.kwonlyargs:
+            yield arg
+        for arg in (args.vararg, args.kwarg):
+            if arg is not None:
+                yield arg
+
+    def visit_Name(self, node):
+        kind = self.kind(node.id)
+        if kind is not None:
+            self.add(node.lineno, node.col_offset, len(node.id), kind)
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if isinstance(node.value, ast.Name) and node.value.id == 'self' and \
+                node.end_lineno == node.lineno:
+            self.add(node.end_lineno, node.end_col_offset - len(node.attr),
+                     len(node.attr), 'self_attribute')
+
+
+def analyse(emit, text, revision):
+    """ Works out the semantic spans of Python source in a worker process.
+
+        Emits (revision, {line number: ((column, length, kind), ...)}), or
+        (revision, None) if the text does not parse.
+    """
+    try:
+        tree = ast.parse(text)
+        table = symtable.symtable(text, '<editor>', 'exec')
+    except (SyntaxError, ValueError):
+        emit((revision, None))
+        return
+    analyser = _Analyser(text.split('\n'), table)
+    analyser.visit(tree)
+    emit((revision, dict((line, tuple(spans))
+                         for line, spans in analyser.spans.items())))
+
+
+class SemanticOverlay(QtCore.QObject):
+    """ Semantic highlighting layered over the lexical highlighting.
+
+        After a pause in typing, the document is analysed with ``ast`` and
+        ``symtable`` in a worker process. Results for an older revision of
+        the document are dropped; otherwise the lines whose spans changed are
+        re-highlighted in small time-boxed slices.
+    """
+
+    # Typing pause before analysing (ms) and time per slice of lines (s)
+    delay = 500
+    slice_time = 0.01
+
+    def __init__(self, editor):
+        super(SemanticOverlay, self).__init__(editor)
+        self._editor = editor
+        self._job = None
+        self._lines = {}
+        self._dirty = []
+        self.enabled = True
+
+        # Bumped on every change of the text (QTextDocument.revision also
+        # changes when blocks are highlighted)
+        self.revision = 0
+
+        self._pause = QtCore.QTimer(self)
+        self._pause.setSingleShot(True)
+        self._pause.setInterval(self.delay)
+        self._pause.timeout.connect(self._analyse)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._apply_slice)
+
+        editor.document().contentsChange.connect(self._changed)
+
+    def set_enabled(self, enabled):
+        """ Turns the overlay on or off, clearing it when turned off.
+        """
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        if enabled:
+            self._pause.start()
+        else:
+            self._cancel()
+            self._dirty = list(self._lines)
+            self._lines = {}
+            self._timer.start()
+
+    def spans(self, block, text):
+        """ Returns the (column, length, token) spans of a block, if it still
+        has the text that was analysed.
+        """
+        if not self._lines:
+            return ()
+        entry = self._lines.get(block.blockNumber())
+        if entry is not None and entry[0] == text:
+            return entry[1]
+        return ()
+
+    def _analyse(self):
+        """ Starts analysing a snapshot of the document.
+        """
+        self._cancel()
+        if not self.enabled:
+            return
+        document = self._editor.document()
+        self._job = ProcessJob(
+            analyse, (document.toPlainText(), self.revision), parent=self)
+        self._job.batch.connect(self._receive)
+        self._job.done.connect(self._cancel_job)
+        self._job.failed.connect(self._cancel_job)
+        self._job.start()
+
+    def _apply_slice(self):
+        """ Re-highlights changed lines until the slice's time runs out.
+        """
+        deadline = perf_counter() + self.slice_time
+        lines = []
+        while self._dirty and perf_counter() < deadline:
+            lines.append(self._dirty.pop())
+            if len(lines) == 20:
+                self._editor.highlighter.rehighlight_lines(lines)
+                lines = []
+        self._editor.highlighter.rehighlight_lines(lines)
+        if not self._dirty:
+            self._timer.stop()
+
+    def _cancel(self):
+        self._pause.stop()
+        self._cancel_job()
+
+    def _cancel_job(self, *args):
+        if self._job is not None:
+            self._job.cancel()
+            self._job.deleteLater()
+            self._job = None
+
+    def _changed(self, *args):
+        """ Restarts the typing pause; a running analysis is now stale.
+        """
+        self.revision += 1
+        self._cancel()
+        if self.enabled:
+            self._pause.start()
+
+    def _receive(self, result):
+        """ Applies an analysis, unless the document changed since.
+        """
+        revision, spans = result
+        if spans is None or revision != self.revision:
+            return
+        document = self._editor.document()
+
+        # Work out which lines changed, keeping the text they apply to
+        lines = {}
+        block = document.begin()
+        for line in sorted(spans):
+            while block.isValid() and block.blockNumber() < line:
+                block = block.next()
+            if not block.isValid():
+                break
+            lines[line] = (block.text(), tuple(
+                (column, length, SEMANTIC_TOKENS[kind])
+                for column, length, kind in spans[line]))
+        dirty = set(line for line in lines
+                    if self._lines.get(line) != lines[line])
+        dirty.update(line for line in self._lines if line not in lines)
+        self._lines = lines
+
+        # Visible lines first (the list is applied from the end)
+        first = self._editor.firstVisibleBlock().blockNumber()
+        self._dirty = sorted(dirty, key=lambda line: (
+            first <= line <= first + 100, -line))
+        if self._dirty:
+            self._timer.start()
@@ -2,9 +2,12 @@
 #  styles.py
 #
 from pygments.style import Style
-from pygments.token import Keyword, Name, Comment, String, Error, \
+from pygments.token import Token, Keyword, Name, Comment, String, Error, \
     Number, Operator, Generic, Whitespace
 
+# Token types of the semantic highlighting (see src/semantic.py)
+Semantic = Token.Semantic
+
 
 class PythonStyle(Style):
     """
@@ -55,5 +58,82 @@ class PythonStyle(Style):
         Generic.Output:             '#888888', # ?
         Generic.Traceback:          '#aa0000', # ?
 
-        Error:                      '#F00 bg:#FAA' # Errors
+        Error:                      '#F00 bg:#FAA', # Errors
+
+        Semantic.Parameter:         '#7a4b00', # Function parameters
+        Semantic.Local:             '#000000', # Local variables
+        Semantic.Global:            '#00007a', # Module level names
+        Semantic.SelfAttribute:     '#00007a', # self.<attribute>
+        Semantic.Unresolved:        'underline #000000', # Undefined names
+        Semantic.ShadowedBuiltin:   'bold #900090', # e.g. list = []
     }
+
+
+class PythonDarkStyle(Style):
+    """
+    A dark version of PythonStyle.
+    """
+
+    default_style = ""
+    background_color = '#1e1e1e'
+
+    styles = {
+        Token:                      '#d4d4d4', # Everything else
+        Whitespace:                 '#1e1e1e', # Whitespace (html)
+
+        Comment:                    '#e06c6c', # Comments
+        Comment.Preproc:            '#e06c6c', # Comments (?)
+        Comment.Special:            '#e06c6c', # Comments (?)
+
+        Keyword:                    '#ff9d3b', # Keywords
+        Keyword.Type:               '#ff9d3b', # Keywords
+        Keyword.Constant:           '#d291e4', # True/False
+
+        Operator.Word:              '#ff9d3b', # in, and, or (and such)
+
+        Name.Builtin:               '#d291e4', # all, abs (and such)
+        Name.Builtin.Pseudo:        '#d4d4d4', # self, True, False
+        Name.Function:              '#6cb6ff', # def <name.function>
+        Name.Class:                 '#6cb6ff', # class <name.class>
+        Name.Namespace:             '#d4d4d4', # import <...> or from <...>
+        Name.Variable:              '#f08080', # ?
+        Name.Constant:              '#f08080', # ?
+        Name.Entity:                'bold #e06c6c', # ?
+        Name.Attribute:             '#87cefa', # ?
+        Name.Tag:                   'bold #87cefa', # ?
+        Name.Decorator:             '#d291e4', # Decorator
+
+        String:                     '#7ec87e', # String
+        String.Symbol:              '#7ec87e', # String
+        String.Regex:               '#7ec87e', # String
+
+        Number:                     '#8fd18f',  # Numbers
+
+        Generic.Heading:            'bold #8080ff', # ?
+        Generic.Subheading:         'bold #d291e4', # ?
+        Generic.Deleted:            '#f08080', # ?
+        Generic.Inserted:           '#7ec87e', # ?
+        Generic.Error:              '#f08080', # ?
+        Generic.Emph:               'italic', # ?
+        Generic.Strong:             'bold', # ?
+        Generic.Prompt:             '#aaaaaa', # ?
+        Generic.Output:             '#888888', # ?
+        Generic.Traceback:          '#f08080', # ?
+
+        Error:                      '#F00 bg:#5a1d1d', # Errors
+
+        Semantic.Parameter:         '#e5c07b', # Function parameters
+        Semantic.Local:             '#d4d4d4', # Local variables
+        Semantic.Global:            '#9cdcfe', # Module level names
+        Semantic.SelfAttribute:     '#9cdcfe', # self.<attribute>
+        Semantic.Unresolved:        'underline #d4d4d4', # Undefined names
+        Semantic.ShadowedBuiltin:   'bold #d291e4', # e.g. list = []
+    }
+
+
+# Themes by name: the Pygments style for the editors and the stylesheet (in
+# the theme folder) for the rest of the IDE
+THEMES = {
+    'IDLE': (PythonStyle, 'style.qss'),
+    'IDLE Dark': (PythonDarkStyle, 'dark.qss'),
+}
@@ -0,0 +1,109 @@
+#
+#  symbols.py
+#
+import re
+from bisect import bisect_left
+from PySide2 import QtCore
+from src.highlighter import grow_range, in_string
+
+_symbol = re.compile(r'([ \t]*)(?:async[ \t]+)?(def|class)[ \t]+(\w+)')
+
+
+class SymbolIndex(QtCore.QObject):
+    """ Index of the def and class statements of a document, by line.
+
+        Changes are gathered into one range of the document and, when the
+        index is next read, only the lines in that range are scanned again;
+        the symbols after it are renumbered. Lines that start inside a
+        string are left out when read, going by the highlighter's block
+        states at that time.
+    """
+
+    # Ranges of more blocks than this are read from the plain text
+    plain_text_blocks = 1000
+
+    def __init__(self, document, parent=None):
+        super(SymbolIndex, self).__init__(parent)
+        self._document = document
+        self._count = document.blockCount()
+        self._lines = []
+        self._symbols = []
+        self._dirty = (0, document.characterCount())
+        document.contentsChange.connect(self._contents_change)
+
+    def symbols(self):
+        """ Returns the (line number, qualified name, kind) of each symbol,
+        in document order; names are qualified by their enclosing classes
+        and functions.
+        """
+        self._sync()
+        document = self._document
+        result = []
+        scopes = []
+        for line, (indent, kind, name) in zip(self._lines, self._symbols):
+            # Leave out lines the highlighter has since found in a string
+            if line and in_string(document.findBlockByNumber(line - 1)):
+                continue
+            while scopes and scopes[-1][0] >= indent:
+                scopes.pop()
+            qualified = '.'.join([scope[1] for scope in scopes] + [name])
+            scopes.append((indent, name))
+            result.append((line, qualified, kind))
+        return result
+
+    #---------------------------------------------------------------------------
+    # Protected interface
+    #---------------------------------------------------------------------------
+
+    def _contents_change(self, position, removed, added):
+        """ Grows the changed [start, end) range of characters.
+        """
+        self._dirty = grow_range(self._dirty, position, removed, added)
+
+    def _texts(self, block, count):
+        """ Yields the text of count blocks from block on.
+        """
+        if count > self.plain_text_blocks:
+            # Splitting the plain text is quicker than a wrapper per block,
+            # if no line separators within blocks throw the lines off
+            texts = self._document.toPlainText().split('\n')
+            if len(texts) == self._document.blockCount():
+                number = block.blockNumber()
+                for text in texts[number:number + count]:
+                    yield text
+                return
+        for _ in range(count):
+            yield block.text()
+            block = block.next()
+
+    def _sync(self):
+        """ Scans the lines of the changed range again and renumbers the
+        symbols after it.
+        """
+        if self._dirty is None:
+            return
+        (start, end), self._dirty = self._dirty, None
+        document = self._document
+        first = document.findBlock(start)
+        if not first.isValid():
+            first = document.lastBlock()
+        last = document.findBlock(end)
+        if not last.isValid():
+            last = document.lastBlock()
+        delta = document.blockCount() - self._count
+        self._count = document.blockCount()
+
+        # Renumber the symbols after the range, and scan the range itself
+        low = bisect_left(self._lines, first.blockNumber())
+        high = bisect_left(self._lines, last.blockNumber() - delta + 1)
+        lines, symbols = [], []
+        numbers = range(first.blockNumber(), last.blockNumber() + 1)
+        for number, text in zip(numbers, self._texts(first, len(numbers))):
+            match = _symbol.match(text)
+            if match is not None:
+                lines.append(number)
+                symbols.append((len(match.group(1).expandtabs(4)),
+                                match.group(2), match.group(3)))
+        self._lines[low:] = lines + [line + delta
+                                     for line in self._lines[high:]]
+        self._symbols[low:] = symbols + self._symbols[high:]
@@ -0,0 +1,112 @@
+#
+#  worker.py
+#
+import multiprocessing
+import traceback
+from time import perf_counter
+from PySide2 import QtCore
+
+
+def _run_job(function, args, connection):
+    """ Entry point of the worker process.
+    """
+    try:
+        function(lambda data: connection.send(('batch', data)), *args)
+        connection.send(('done', None))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+class ProcessJob(QtCore.QObject):
+    """ Runs a function in a worker process and streams its results back.
+
+        ``function(emit, *args)`` is called in the worker and passes each
+        batch of results to ``emit``; they arrive on the GUI thread through
+        the ``batch`` signal. The function and its arguments must be
+        picklable.
+    """
+
+    batch = QtCore.Signal(object)
+    done = QtCore.Signal()
+    failed = QtCore.Signal(str)
+
+    # How often the pipe is polled and how long each poll may take (ms)
+    poll_interval = 10
+    poll_budget = 0.005
+
+    def __init__(self, function, args=(), timeout=None, parent=None):
+        super(ProcessJob, self).__init__(parent)
+        self._function = function
+        self._args = args
+        self._process = None
+        self._connection = None
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(self.poll_interval)
+        self._timer.timeout.connect(self._poll)
+
+        # Give up (and report a failure) after timeout ms
+        self._timeout = QtCore.QTimer(self)
+        self._timeout.setSingleShot(True)
+        self._timeout.timeout.connect(self._timed_out)
+        self.timeout = timeout
+
+    def cancel(self):
+        """ Stops the worker; no more signals are emitted.
+        """
+        self._timer.stop()
+        self._timeout.stop()
+        if self._process is not None:
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process.join()
+            self._process = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def isRunning(self):
+        return self._process is not None
+
+    def start(self):
+        """ Starts the worker process.
+        """
+        self.cancel()
+        receiver, sender = multiprocessing.Pipe(False)
+        self._process = multiprocessing.Process(
+            target=_run_job, args=(self._function, self._args, sender),
+            daemon=True)
+        self._process.start()
+        sender.close()
+        self._connection = receiver
+        self._timer.start()
+        if self.timeout is not None:
+            self._timeout.start(self.timeout)
+
+    def _poll(self):
+        """ Reads whatever the worker has sent, within the poll budget.
+        """
+        deadline = perf_counter() + self.poll_budget
+        while self._connection is not None and perf_counter() < deadline:
+            try:
+                if not self._connection.poll():
+                    return
+                kind, data = self._connection.recv()
+            except (EOFError, OSError):
+                self.cancel()
+                self.failed.emit('The worker process exited unexpectedly')
+                return
+            if kind == 'batch':
+                self.batch.emit(data)
+            else:
+                self.cancel()
+                if kind == 'done':
+                    self.done.emit()
+                else:
+                    self.failed.emit(data)
+
+    def _timed_out(self):
+        self.cancel()
+        self.failed.emit('The worker process timed out')
@@ -0,0 +1,92 @@
+#
+#  benchmark_brackets.py
+#
+""" Time to match a brace across a large document, before (the text scan
+matchBraces used to do) and after BracketIndex.
+
+    python -m tests.benchmark_brackets [lines]
+
+The document is a dict literal of 50000 lines by default; its opening brace
+is matched to the closing one on the last line, and back.
+"""
+import os
+import sys
+from time import perf_counter
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide2 import QtGui, QtWidgets
+
+from src.editor import Editor
+
+
+def scan(text, brace, pos, close=False):
+    """ Returns the (open, close) positions of the braces matching at pos by
+    counting over the text, the way Editor.matchBraces did.
+    """
+    if not close:
+        searchText = text[pos + 1:]
+        other = {'(': ')', '[': ']', '{': '}', '<': '>'}.get(brace)
+    else:
+        searchText = text[:pos][::-1]
+        other = {')': '(', ']': '[', '}': '{', '>': '<'}.get(brace)
+    level = 0
+    for i, char in enumerate(searchText):
+        if char == other:
+            if level:
+                level -= 1
+            else:
+                newpos = pos - 1 - i if close else pos + 1 + i
+                return (newpos, pos) if close else (pos, newpos)
+        elif char == brace:
+            level += 1
+    return None
+
+
+def best(function, repeat=5):
+    """ Returns the best time of calling function, in seconds. """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main(args):
+    lines = int(args[0]) if args else 50000
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    editor = Editor(QtWidgets.QStatusBar())
+    editor.setPlainText('data = {\n' + ''.join(
+        "    'key%d': [%d, (%d, %d)],\n" % (i, i, i, i)
+        for i in range(lines)) + '}\n')
+    app.processEvents()
+    brackets = editor.highlighter.brackets
+    first = editor.toPlainText().index('{')
+    last = editor.document().lastBlock().previous().position()
+    print('%d lines' % editor.document().blockCount())
+
+    assert scan(editor.toPlainText(), '{', first) == (first, last)
+    before = best(lambda: scan(editor.toPlainText(), '{', first))
+    back = best(lambda: scan(editor.toPlainText(), '}', last, close=True))
+    assert brackets.match(first) == last and brackets.match(last) == first
+    after = best(lambda: brackets.match(first))
+    after_back = best(lambda: brackets.match(last))
+
+    def edit():
+        cursor = QtGui.QTextCursor(
+            editor.document().findBlockByNumber(lines // 2))
+        cursor.insertText('\n')
+        brackets.match(first)
+
+    enter = best(edit)
+    print('old scan forward   %10.3f ms' % (before * 1e3))
+    print('old scan backward  %10.3f ms' % (back * 1e3))
+    print('index forward      %10.3f ms' % (after * 1e3))
+    print('index backward     %10.3f ms' % (after_back * 1e3))
+    print('Enter + match      %10.3f ms' % (enter * 1e3))
+    print('speedup            %10.0fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
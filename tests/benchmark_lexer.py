@@ -0,0 +1,62 @@
+#
+#  benchmark_lexer.py
+#
+""" Lines per second of the highlighter's line lexing, before (the reference
+lexer) and after HighlightLexer, over Python files.
+
+    python -m tests.benchmark_lexer [file or directory ...]
+
+With no arguments, the modules of the standard library are lexed.
+"""
+import glob
+import os
+import sys
+from time import perf_counter
+
+from pygments.lexers import PythonLexer
+
+from src.lexer import HighlightLexer
+from tests.reference_lexer import reference_lex
+
+
+def read_lines(paths):
+    """ Returns the lines of the Python files at the given paths. """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.py')))
+        else:
+            files.append(path)
+    lines = []
+    for path in files:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            lines += f.read().split('\n')
+    return files, lines
+
+
+def lines_per_second(lex, lines, repeat=3):
+    """ Returns the best rate of lexing lines one after another. """
+    best = float('inf')
+    for _ in range(repeat):
+        stack = ('root',)
+        start = perf_counter()
+        for line in lines:
+            _, stack = lex(stack, line)
+        best = min(best, perf_counter() - start)
+    return len(lines) / best
+
+
+def main(paths):
+    files, lines = read_lines(paths or [os.path.dirname(os.__file__)])
+    print('%d files, %d lines' % (len(files), len(lines)))
+    lexer = PythonLexer()
+    before = lines_per_second(
+        lambda stack, line: reference_lex(lexer, stack, line), lines)
+    after = lines_per_second(HighlightLexer(lexer).lex, lines)
+    print('before  %10.0f lines/s' % before)
+    print('after   %10.0f lines/s' % after)
+    print('speedup %10.2fx' % (after / before))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
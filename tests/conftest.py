@@ -0,0 +1,20 @@
+#
+#  conftest.py
+#
+import os
+import sys
+
+import pytest
+
+# Qt needs no display for these tests, and the src package is imported from
+# the repository root
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide2 import QtWidgets
+
+
+@pytest.fixture(scope='session')
+def app():
+    """ The QApplication shared by every test. """
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
@@ -0,0 +1,108 @@
+#
+#  reference_lexer.py
+#
+""" The line lexing the highlighter did before HighlightLexer, kept as the
+reference that HighlightLexer must match (see test_lexer.py and
+benchmarks/lexer_benchmark.py).
+
+This is the RegexLexer.get_tokens_unprocessed monkeypatch that used to be
+in src/highlighter.py, as a function of the lexer instead of a patch.
+"""
+from pygments.lexer import _TokenType
+from pygments.token import Token, Text, Error
+
+from src.lexer import _runs
+
+
+def reference_tokens(self, text, stack=('root',)):
+    """ Yields the (index, tokentype, text) triples of text, lexed from a
+    syntax stack; the exit stack is left on self._saved_state_stack.
+    """
+    pos = 0
+    tokendefs = self._tokens
+    tokens = self.tokens
+    keywords = tokens['keywords'][0][0].words
+    if 'Python' in self.name and not 'from' in keywords:
+        keywords += ('from',)
+    statestack = list(stack)
+    statetokens = tokendefs[statestack[-1]]
+    while 1:
+        for rexmatch, action, new_state in statetokens:
+            m = rexmatch(text, pos)
+            if m:
+                if type(action) is _TokenType:
+                    if m.group() in keywords:
+                        action = Token.Keyword
+                    elif m.group() in tokens['builtins'][0][0].words:
+                        action = Token.Name.Builtin
+                    yield pos, action, m.group()
+                elif action:
+                    for item in action(self, m):
+                        yield item
+                pos = m.end()
+                if new_state is not None:
+                    # state transition
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == '#pop':
+                                statestack.pop()
+                            elif state == '#push':
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        # pop
+                        del statestack[new_state:]
+                    elif new_state == '#push':
+                        statestack.append(statestack[-1])
+                    else:
+                        assert False, "wrong state def: %r" % new_state
+                    statetokens = tokendefs[statestack[-1]]
+                break
+        else:
+            try:
+                if text[pos] == '\n':
+                    # at EOL, reset state to "root"
+                    pos += 1
+                    statestack = ['root']
+                    statetokens = tokendefs['root']
+                    yield pos, Text, u'\n'
+                    continue
+                yield pos, Error, text[pos]
+                pos += 1
+            except IndexError:
+                break
+    self._saved_state_stack = list(statestack)
+
+
+def reference_lex(lexer, stack, string):
+    """ Lexes one line the way the highlighter used to, returning the merged
+    (token, length) runs and the exit stack, as HighlightLexer.lex does.
+    """
+    tokens = [(token, value) for _, token, value in
+              reference_tokens(lexer, string + '\n', stack)]
+    return _runs(tokens), tuple(lexer._saved_state_stack)
+
+
+if __name__ == '__main__':
+    # Records the expected token streams of the corpus for test_lexer.py,
+    # e.g. for a new Pygments version:  python -m tests.reference_lexer
+    import json
+    import os
+    import pygments
+    from pygments.lexers import PythonLexer
+
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    lexer = PythonLexer()
+    with open(os.path.join(data, 'lexer_corpus.txt')) as f:
+        lines = f.read().split('\n')
+    stack = ('root',)
+    records = []
+    for line in lines:
+        runs, stack = reference_lex(lexer, stack, line)
+        records.append(json.dumps({
+            'runs': [[str(token), length] for token, length in runs],
+            'stack': list(stack)}))
+    with open(os.path.join(data, 'lexer_tokens.json'), 'w') as f:
+        f.write('{"pygments": %s, "lines": [\n%s\n]}\n' % (
+            json.dumps(pygments.__version__), ',\n'.join(records)))
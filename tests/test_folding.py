@@ -0,0 +1,58 @@
+#
+#  test_folding.py
+#
+from PySide2 import QtWidgets
+import pytest
+
+from src.editor import Editor
+
+
+@pytest.fixture
+def editor(app):
+    editor = Editor(QtWidgets.QStatusBar())
+    editor.resize(600, 400)
+    editor.show()
+    yield editor
+    editor.deleteLater()
+
+
+def fold(editor, app, text):
+    """ Folds the region headed by the first line of text and returns the
+    lines left visible.
+    """
+    editor.setPlainText(text)
+    app.processEvents()
+    editor.folds.fold(editor.document().firstBlock())
+    block = editor.document().firstBlock()
+    visible = []
+    while block.isValid():
+        if block.isVisible():
+            visible.append(block.text())
+        block = block.next()
+    return visible
+
+
+@pytest.mark.parametrize('text, visible', [
+    ('def f():\n    x = 1\n    y = 2\n\nz = 3',
+     ['def f():', '', 'z = 3']),
+    ('def f():\n    return """\ntext\n"""\nx = 1',
+     ['def f():', 'x = 1']),
+    ('def f():\n    return g(1,\n2)\nx = 1',
+     ['def f():', 'x = 1']),
+    ('def f():\n    return g(1,\n2)',
+     ['def f():']),
+    ('x = """\n    text\n"""\ny = 1',
+     ['x = """', '    text', '"""', 'y = 1']),
+])
+def test_fold_hides_the_whole_region(editor, app, text, visible):
+    assert fold(editor, app, text) == visible
+
+
+def test_unfold_shows_every_line(editor, app):
+    text = 'def f():\n    return """\ntext\n"""\nx = 1'
+    fold(editor, app, text)
+    editor.unfold_all()
+    block = editor.document().firstBlock()
+    while block.isValid():
+        assert block.isVisible()
+        block = block.next()
@@ -0,0 +1,78 @@
+#
+#  test_highlighter.py
+#
+from PySide2 import QtGui, QtWidgets
+import pytest
+
+from src.highlighter import PygmentsHighlighter
+
+SOURCE = '''\
+import os
+
+def f(x):
+    """ A docstring
+    over three
+    lines.
+    """
+    # A comment
+    return [x,
+            os.sep]
+
+y = f(1)
+z = 2
+'''
+
+
+@pytest.fixture
+def edit(app):
+    """ A plain text edit showing SOURCE with an eager highlighter. """
+    edit = QtWidgets.QPlainTextEdit()
+    edit.highlighter = PygmentsHighlighter(edit)
+    edit.setPlainText(SOURCE)
+    yield edit
+    edit.deleteLater()
+
+
+def relexed(edit, line, column, text):
+    """ Inserts text at a line and column and returns how many blocks were
+    lexed again.
+    """
+    block = edit.document().findBlockByNumber(line)
+    cursor = QtGui.QTextCursor(block)
+    cursor.setPosition(block.position() + column)
+    before = edit.highlighter.lexed_blocks
+    cursor.insertText(text)
+    return edit.highlighter.lexed_blocks - before
+
+
+@pytest.mark.parametrize('line, column, text', [
+    (0, 6, 'path'),         # code
+    (4, 8, ' more'),        # inside the docstring
+    (7, 10, ' more'),       # inside the comment
+    (8, 12, ' + 1'),        # inside the brackets
+])
+def test_edit_relexes_one_block(edit, line, column, text):
+    assert relexed(edit, line, column, text) == 1
+
+
+def test_opening_string_relexes_to_the_end(edit):
+    count = edit.document().blockCount()
+    assert relexed(edit, 11, 0, '"""') == count - 11
+
+
+def test_closing_string_stops_where_states_match(edit):
+    count = edit.document().blockCount()
+    relexed(edit, 11, 0, '"""')
+    # Closing it on the same line restores every later block's state
+    assert relexed(edit, 11, 3, '"""') == count - 11
+    assert relexed(edit, 12, 0, '# ') == 1
+
+
+def test_lines_after_a_string_keep_their_states(edit):
+    document = edit.document()
+    states = [document.findBlockByNumber(number).userState()
+              for number in range(document.blockCount())]
+    relexed(edit, 4, 8, ' more')
+    assert [document.findBlockByNumber(number).userState()
+            for number in range(document.blockCount())] == states
+    assert states[4] != states[0]
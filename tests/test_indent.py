@@ -0,0 +1,84 @@
+#
+#  test_indent.py
+#
+from PySide2 import QtCore, QtWidgets
+from PySide2.QtTest import QTest
+import pytest
+
+from src.editor import Editor
+
+# The text before Enter, with | for the cursor, and the indentation IDLE
+# gives the new line
+CASES = [
+    # Block statements
+    ('x = 1|', 0),
+    ('def f():|', 4),
+    ('def f():  # comment|', 4),
+    ('class A:\n    def f(self):|', 8),
+    ('def f():\n    return 1|', 0),
+    ('def f():\n    if x:\n        pass|', 4),
+    ('for a in b:\n    break|', 0),
+    ('while 1:\n    raise X|', 0),
+    ('def f():\n    x = 1\n    |', 4),
+    ('if x: pass|', 0),
+    ('d = {1: 2}|', 0),
+    # Brackets
+    ('x = f(a,|', 6),
+    ('x = f(|', 4),
+    ('    x = f(|', 8),
+    ('x = f(  # hi|', 4),
+    ('x = [1, [2,|', 9),
+    ('x = f(a,\n      b)|', 0),
+    ('def g():\n    x = f(a,\n          b)|', 4),
+    ('if f(a,\n     b):|', 4),
+    ('x = "(" + f(a,|', 12),
+    ('x = {\n    "a": 1,|', 4),
+    ('x = f(a,\n      b,|', 6),
+    ('def f(a,\n      b):|', 4),
+    # Backslash continuations
+    ('x = 1 + \\|', 4),
+    ('assert x, \\|', 7),
+    ('x = 1 + \\\n    2 + \\|', 4),
+    # Strings and comments
+    ('s = """abc|', 0),
+    ('s = """abc\n   def|', 3),
+    ('s = """\nabc\n"""|', 0),
+    ('def f():\n    s = """\nabc\n"""|', 4),
+    ('x = 1  # f(|', 0),
+    # Text after the cursor moves down without its leading whitespace
+    ('f(a)|b', 0),
+    ('    f(a)|  b', 4),
+]
+
+
+@pytest.fixture(scope='module')
+def editor(app):
+    editor = Editor(QtWidgets.QStatusBar())
+    editor.show()
+    yield editor
+    editor.deleteLater()
+
+
+def press_enter(editor, text):
+    """ Sets text, with | for the cursor, and presses Enter. """
+    before, after = text.split('|')
+    editor.setPlainText(before + after)
+    cursor = editor.textCursor()
+    cursor.setPosition(len(before))
+    editor.setTextCursor(cursor)
+    QTest.keyClick(editor, QtCore.Qt.Key_Return)
+    return editor.textCursor().block().text()
+
+
+@pytest.mark.parametrize('text, indent', CASES)
+def test_newline_indent(editor, text, indent):
+    line = press_enter(editor, text)
+    assert len(line) - len(line.lstrip(' ')) == indent
+    assert line.strip() == text.split('|')[1].strip()
+
+
+def test_whitespace_line_is_cleared_in_one_undo_step(editor):
+    press_enter(editor, 'def f():\n    x = 1\n    |')
+    assert editor.toPlainText() == 'def f():\n    x = 1\n\n    '
+    editor.document().undo()
+    assert editor.toPlainText() == 'def f():\n    x = 1\n    '
@@ -0,0 +1,88 @@
+#
+#  test_lexer.py
+#
+import glob
+import json
+import os
+
+import pygments
+import pytest
+from pygments.lexers import PythonLexer
+
+from src.lexer import LEXERS, HighlightLexer, lexer_for_filename
+from reference_lexer import reference_lex
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Lines that every file type's lexer must get through, including ones that
+# hand text to other lexers from a callback
+SAMPLES = [
+    'x = 1  # comment',
+    '<p class="a">text</p>',
+    '<style>p { color: red }</style><script>var x = "s";</script>',
+    '```python',
+    '[section] key = "value" {a: [1, 2]}',
+    '',
+]
+
+
+def corpus():
+    with open(os.path.join(DATA, 'lexer_corpus.txt')) as f:
+        return f.read().split('\n')
+
+
+def lex_lines(lex, lines):
+    """ Lexes lines one by one, each from the exit stack of the last, and
+    returns the [(token, length) runs, exit stack] of each line.
+    """
+    stack = ('root',)
+    result = []
+    for line in lines:
+        runs, stack = lex(stack, line)
+        result.append((runs, tuple(stack)))
+    return result
+
+
+def test_matches_expected_token_streams():
+    with open(os.path.join(DATA, 'lexer_tokens.json')) as f:
+        expected = json.load(f)
+    if expected['pygments'] != pygments.__version__:
+        pytest.skip('token streams were recorded with Pygments %s'
+                    % expected['pygments'])
+    lexer = HighlightLexer(PythonLexer())
+    result = [([[str(token), length] for token, length in runs], list(stack))
+              for runs, stack in lex_lines(lexer.lex, corpus())]
+    assert result == [(line['runs'], line['stack'])
+                      for line in expected['lines']]
+
+
+@pytest.mark.parametrize('path', ['tests/data/lexer_corpus.txt'] + sorted(
+    os.path.relpath(path, ROOT)
+    for path in glob.glob(os.path.join(ROOT, '*.py')) +
+    glob.glob(os.path.join(ROOT, 'src', '*.py'))))
+def test_matches_reference_lexer(path):
+    lexer = PythonLexer()
+    with open(os.path.join(ROOT, path), encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    assert lex_lines(HighlightLexer(lexer).lex, lines) == \
+        lex_lines(lambda stack, line: reference_lex(lexer, stack, line), lines)
+
+
+@pytest.mark.parametrize('extension', sorted(LEXERS))
+def test_every_file_type_lexes_sample_lines(extension):
+    lexer = lexer_for_filename('sample' + extension)
+    stack = ('root',)
+    for line in SAMPLES:
+        runs, stack = lexer.lex(stack, line)
+        assert sum(length for token, length in runs) == len(line) + 1
+
+
+def test_callbacks_see_the_wrapped_lexer():
+    # Markdown hands fenced code to another lexer from a callback that
+    # reads the Markdown lexer's options
+    lexer = lexer_for_filename('notes.md')
+    text = '```python\nx = 1\n```\n'
+    assert ''.join(value for _, _, value in
+                   lexer.get_tokens_unprocessed(text)) == text
@@ -0,0 +1,35 @@
+#
+#  test_region.py
+#
+from PySide2 import QtWidgets
+import pytest
+
+from src import region
+from src.editor import Editor
+
+
+@pytest.mark.parametrize('transform, line, expected', [
+    (region.indent, 'a', '    a'),
+    (region.indent, '', ''),
+    (region.dedent, '      a', '  a'),
+    (region.dedent, '\ta', 'a'),
+    (region.dedent, '', ''),
+    (region.tabify, '      a', '\t  a'),
+    (region.tabify, '', ''),
+    (region.untabify, '\ta', '    a'),
+    (region.comment, 'a', '##a'),
+    (region.uncomment, '##a', 'a'),
+    (region.uncomment, '#a', 'a'),
+    (region.strip, 'a  \t', 'a'),
+])
+def test_transforms(transform, line, expected):
+    assert transform(line) == expected
+
+
+def test_indenting_a_region_leaves_blank_lines_empty(app):
+    editor = Editor(QtWidgets.QStatusBar())
+    editor.setPlainText('a\n\nb')
+    editor.selectAll()
+    editor.transform_region(region.indent)
+    assert editor.toPlainText() == '    a\n\n    b'
+    editor.deleteLater()
@@ -0,0 +1,100 @@
+#
+#  test_search.py
+#
+import time
+
+from PySide2 import QtCore, QtWidgets
+import pytest
+
+from src.editor import Editor
+from src.highlighter import grow_range
+
+
+@pytest.fixture
+def editor(app):
+    editor = Editor(QtWidgets.QStatusBar())
+    editor.find_fromStart = QtCore.Qt.Checked
+    yield editor
+    editor.deleteLater()
+
+
+def wait(app, condition, timeout=10):
+    """ Processes events until condition() is true or timeout s pass. """
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+
+
+def replace(editor, app, text, find, template):
+    """ Replaces the first regex match of find in text with template and
+    returns the document's text once the worker is done.
+    """
+    editor.setPlainText(text)
+    states = {'caseSensitive': True, 'wholeWord': False, 'regex': True}
+    editor.find(find, states, replace=template)
+    wait(app, lambda: not editor.search.searching)
+    editor.find_fromStart = QtCore.Qt.Checked
+    wait(app, lambda: not editor.statusBar.currentMessage().startswith(
+        ('Searching', 'Replacing')))
+    return editor.toPlainText()
+
+
+@pytest.mark.parametrize('text, find, template, expected', [
+    ('ab b', r'(?<=a)b', r'[\g<0>]', 'a[b] b'),
+    ('xfoo foo', r'\bfoo', r'<\g<0>>', 'xfoo <foo>'),
+    ('a\nx', r'^x', r'y', 'a\ny'),
+    ('\U0001f600 ab', r'(a)(b)', r'\2\1', '\U0001f600 ba'),
+])
+def test_regex_replace_expands_in_context(editor, app, text, find, template,
+                                          expected):
+    assert replace(editor, app, text, find, template) == expected
+
+
+def test_bad_template_inserts_nothing(editor, app):
+    assert replace(editor, app, 'ab', 'a', r'\3') == 'ab'
+    assert editor.statusBar.currentMessage().startswith('Search stopped')
+
+
+def test_edited_match_is_not_replaced(editor, app):
+    editor.setPlainText('ab')
+    states = {'caseSensitive': True, 'wholeWord': False, 'regex': True}
+    editor.find('ab', states)
+    wait(app, lambda: not editor.search.searching)
+    editor.find_fromStart = QtCore.Qt.Checked
+    editor.find('ab', states, replace='x')
+    cursor = editor.textCursor()
+    cursor.setPosition(1)
+    cursor.insertText('-')
+    wait(app, lambda: not editor.statusBar.currentMessage().startswith(
+        'Replacing'))
+    assert editor.toPlainText() == 'a-b'
+    assert 'not replaced' in editor.statusBar.currentMessage()
+
+
+@pytest.mark.parametrize('changes, expected', [
+    ([(5, 0, 3)], (5, 8)),
+    ([(5, 0, 3), (2, 1, 0)], (2, 7)),
+    ([(5, 0, 3), (20, 0, 2)], (5, 22)),
+    ([(5, 2, 0), (5, 0, 1)], (5, 6)),
+])
+def test_grow_range(changes, expected):
+    changed = None
+    for change in changes:
+        changed = grow_range(changed, *change)
+    assert changed == expected
+
+
+def test_index_follows_edits(editor, app):
+    editor.setPlainText('ab ab\nab\n')
+    editor.search.set_query('ab')
+    cursor = editor.textCursor()
+    for position, text in [(0, 'x'), (4, 'ab'), (9, '\nab')]:
+        cursor.setPosition(position)
+        cursor.insertText(text)
+    cursor.setPosition(1)
+    cursor.setPosition(2, cursor.KeepAnchor)
+    cursor.removeSelectedText()
+    text = editor.toPlainText()
+    expected = [(i, i + 2) for i in range(len(text)) if text[i:i + 2] == 'ab']
+    assert editor.search.spans(0, len(text)) == expected